@@ -0,0 +1,132 @@
+import time
+
+import numpy as np
+
+from game2048 import ROW_LEFT, ROW_RIGHT, SCORE_LEFT, SCORE_RIGHT, COL_UP, COL_DOWN
+
+#lockstep engine for the cheap strategies (1 random, 2 right/down, 3 greedy)
+#every live game is one packed uint64 board (same layout as Game2048.bitboard) and each turn is applied to all of them at once
+
+NP_ROW_LEFT = np.array(ROW_LEFT, dtype=np.uint64)
+NP_ROW_RIGHT = np.array(ROW_RIGHT, dtype=np.uint64)
+NP_COL_UP = np.array(COL_UP, dtype=np.uint64)
+NP_COL_DOWN = np.array(COL_DOWN, dtype=np.uint64)
+NP_SCORE_LEFT = np.array(SCORE_LEFT, dtype=np.int64)
+NP_SCORE_RIGHT = np.array(SCORE_RIGHT, dtype=np.int64)
+
+ROW_MASK = np.uint64(0xFFFF)
+NIBBLE_MASK = np.uint64(0xF)
+CELL_SHIFTS = np.arange(0, 64, 4, dtype=np.uint64)
+BATCH_CHUNK = 65536 #games simulated together, bounds the (games, 16) temporaries
+
+def u64(x):
+    return np.uint64(x)
+
+def transpose(b): #same masked shifts as game2048.transpose
+    a = (b & u64(0xF0F00F0FF0F00F0F)) | ((b & u64(0x0000F0F00000F0F0)) << u64(12)) | ((b & u64(0x0F0F00000F0F0000)) >> u64(12))
+    return (a & u64(0xFF00FF0000FF00FF)) | ((a & u64(0x00FF00FF00000000)) >> u64(24)) | ((a & u64(0x00000000FF00FF00)) << u64(24))
+
+def split_rows(b): #table indices for the four 16 bit rows
+    return [((b >> u64(16 * k)) & ROW_MASK).astype(np.intp) for k in range(4)]
+
+def slide_all(boards): #returns (4, n) boards and (4, n) score gains in MOVES order (w, a, s, d)
+    rows = split_rows(boards)
+    cols = split_rows(transpose(boards))
+    new_boards = np.empty((4, len(boards)), dtype=np.uint64)
+    gains = np.empty((4, len(boards)), dtype=np.int64)
+    new_boards[0] = NP_COL_UP[cols[0]] | (NP_COL_UP[cols[1]] << u64(4)) | (NP_COL_UP[cols[2]] << u64(8)) | (NP_COL_UP[cols[3]] << u64(12))
+    gains[0] = NP_SCORE_LEFT[cols[0]] + NP_SCORE_LEFT[cols[1]] + NP_SCORE_LEFT[cols[2]] + NP_SCORE_LEFT[cols[3]]
+    new_boards[1] = NP_ROW_LEFT[rows[0]] | (NP_ROW_LEFT[rows[1]] << u64(16)) | (NP_ROW_LEFT[rows[2]] << u64(32)) | (NP_ROW_LEFT[rows[3]] << u64(48))
+    gains[1] = NP_SCORE_LEFT[rows[0]] + NP_SCORE_LEFT[rows[1]] + NP_SCORE_LEFT[rows[2]] + NP_SCORE_LEFT[rows[3]]
+    new_boards[2] = NP_COL_DOWN[cols[0]] | (NP_COL_DOWN[cols[1]] << u64(4)) | (NP_COL_DOWN[cols[2]] << u64(8)) | (NP_COL_DOWN[cols[3]] << u64(12))
+    gains[2] = NP_SCORE_RIGHT[cols[0]] + NP_SCORE_RIGHT[cols[1]] + NP_SCORE_RIGHT[cols[2]] + NP_SCORE_RIGHT[cols[3]]
+    new_boards[3] = NP_ROW_RIGHT[rows[0]] | (NP_ROW_RIGHT[rows[1]] << u64(16)) | (NP_ROW_RIGHT[rows[2]] << u64(32)) | (NP_ROW_RIGHT[rows[3]] << u64(48))
+    gains[3] = NP_SCORE_RIGHT[rows[0]] + NP_SCORE_RIGHT[rows[1]] + NP_SCORE_RIGHT[rows[2]] + NP_SCORE_RIGHT[rows[3]]
+    return new_boards, gains
+
+def cells(boards): #(n, 16) exponents in row major order
+    return ((boards[:, None] >> CELL_SHIFTS[None, :]) & NIBBLE_MASK).astype(np.uint8)
+
+def add_random_tiles(boards, rng): #adds a 2 to a uniformly random empty cell of every board that has one
+    empty = cells(boards) == 0
+    counts = empty.sum(axis=1)
+    has_empty = counts > 0
+    picks = (rng.random(len(boards)) * counts).astype(np.int64) #index among the empty cells
+    cell = np.argmax(np.cumsum(empty, axis=1, dtype=np.uint8) > picks[:, None], axis=1)
+    tiles = np.where(has_empty, u64(1) << (cell.astype(np.uint64) * u64(4)), u64(0))
+    return boards | tiles
+
+def choose_moves(strategy, new_boards, gains, legal, rng): #vectorized determine_move for strategies 1 - 3
+    n = legal.shape[1]
+    if strategy == 1: #completely random, illegal picks waste the turn like in simulate_game
+        return rng.integers(0, 4, n)
+    if strategy == 2: #random between right/down, else random between up/left
+        r_move = legal[3]
+        d_move = legal[2]
+        moves = rng.integers(0, 2, n) #0/1 is up/left when neither right nor down works
+        both = r_move & d_move
+        moves = np.where(both, moves + 2, moves)
+        moves = np.where(r_move & ~d_move, 3, moves)
+        moves = np.where(d_move & ~r_move, 2, moves)
+        return moves
+    if strategy == 3: #greedy, random between the legal moves with the highest score gain
+        masked = np.where(legal, gains, -1)
+        best = masked.max(axis=0)
+        ties = masked == best[None, :]
+        noise = rng.random((4, n)) * ties #break ties uniformly
+        return np.argmax(np.where(ties, noise, -1.0), axis=0)
+    raise ValueError(f"Strategy {strategy} has no batched implementation")
+
+def simulate_chunk(games, strategy, time_limit, rng, start_time, max_moves=None):
+    final_boards = np.zeros(games, dtype=np.uint64)
+    final_scores = np.zeros(games, dtype=np.int64)
+    #only the live games are kept in the working arrays, a game is written out once it can't move
+    ids = np.arange(games)
+    boards = add_random_tiles(add_random_tiles(np.zeros(games, dtype=np.uint64), rng), rng)
+    scores = np.zeros(games, dtype=np.int64)
+    moves_played = np.zeros(games, dtype=np.int64)
+    final_moves = np.zeros(games, dtype=np.int64)
+    turns = 0
+    while len(ids) and (time.time() - start_time) < time_limit and (max_moves is None or turns < max_moves):
+        turns += 1
+        new_boards, gains = slide_all(boards)
+        legal = new_boards != boards[None, :]
+        can_move = legal.any(axis=0)
+        if not can_move.all(): #game over for everything else
+            over = ~can_move
+            final_boards[ids[over]] = boards[over]
+            final_scores[ids[over]] = scores[over]
+            final_moves[ids[over]] = moves_played[over]
+            ids = ids[can_move]
+            boards = boards[can_move]
+            scores = scores[can_move]
+            moves_played = moves_played[can_move]
+            new_boards = new_boards[:, can_move]
+            gains = gains[:, can_move]
+            legal = legal[:, can_move]
+            if not len(ids):
+                break
+
+        moves = choose_moves(strategy, new_boards, gains, legal, rng)
+        picked = np.arange(len(ids))
+        moved = legal[moves, picked] #a move that doesn't change the board doesn't add a tile
+        boards = np.where(moved, new_boards[moves, picked], boards)
+        boards[moved] = add_random_tiles(boards[moved], rng)
+        scores += np.where(moved, gains[moves, picked], 0)
+        moves_played += moved
+
+    final_boards[ids] = boards #games cut off by the time limit
+    final_scores[ids] = scores
+    final_moves[ids] = moves_played
+    highest = np.left_shift(1, cells(final_boards).max(axis=1).astype(np.int64))
+    return final_scores, highest, final_moves
+
+def simulate_batch(games, strategy, time_limit=float('inf'), seed=None, max_moves=None): #returns [(score, highest, moves)]
+    #time_limit applies to the whole batch, every game still running when it runs out stops where it is
+    rng = np.random.default_rng(seed)
+    start_time = time.time()
+    results = []
+    for chunk_start in range(0, games, BATCH_CHUNK):
+        scores, highest, moves = simulate_chunk(min(BATCH_CHUNK, games - chunk_start), strategy, time_limit, rng, start_time, max_moves)
+        results.extend(zip(scores.tolist(), highest.tolist(), moves.tolist()))
+    return results
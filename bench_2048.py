@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import game2048
+from game2048 import (MOVES, PLAYOUTS, Game2048, TranspositionTable, SearchBudget, Playout, Node, expectimax_policy, mcts_search, evaluate_state,
+                      set_board_size)
+
+"""
+Benchmarks for the engine primitives and the agents, runs under CPython and PyPy:
+
+    python bench_2048.py                     #run everything, write bench_results.json
+    pypy3 bench_2048.py --save-baseline      #store this run as the baseline for this interpreter
+    python bench_2048.py --baseline bench_baseline.json   #flag anything more than --tolerance slower than the baseline
+    python bench_2048.py --size 5            #the same on 5x5 boards, with its own baseline entry
+
+Every benchmark runs on the same seeded positions so numbers are comparable between runs and interpreters.
+The baseline file keeps one entry per interpreter (CPython, PyPy) and board size since their numbers aren't comparable.
+"""
+
+def fixed_positions(count=32, seed=2048): #mid game boards from seeded greedy games, spread over the game
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        game = Game2048(rng.getrandbits(64))
+        stop = rng.randint(20, 400)
+        while game.moves < stop:
+            successors = game.successors()
+            if not successors:
+                break
+            move = MOVES[game.greedy_moves(successors)]
+            for legal_move, board, gained, highest in successors:
+                if legal_move == move:
+                    game.bitboard = board
+                    game.score += gained
+                    game.highest = highest
+                    break
+            game.moves += 1
+            game.add_random_tile()
+        if game.can_move():
+            positions.append(game)
+    return positions
+
+def measure(run, min_time, rounds=3): #run() does some work and returns how many units it did, returns the best units/sec over the rounds
+    best = 0.0
+    for _ in range(rounds):
+        units = 0
+        start = time.perf_counter()
+        while True:
+            units += run()
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = max(best, units / elapsed)
+    return best
+
+def engine_benchmarks(positions, min_time):
+    boards = [game.bitboard for game in positions]
+    rows = [row for game in positions for row in game.board]
+    row_game = Game2048(0)
+    results = {}
+
+    def slide_rows():
+        for row in rows:
+            row_game.slide_row_left(row)
+        return len(rows)
+    results['slide_row_left'] = (measure(slide_rows, min_time), 'rows/s')
+
+    #through the module so the slides of the board size in use are measured
+    for name, slide in zip(['slide_up', 'slide_left', 'slide_down', 'slide_right'], game2048.SLIDES):
+        def slide_boards(slide=slide):
+            for board in boards:
+                slide(board)
+            return len(boards)
+        results[name] = (measure(slide_boards, min_time), 'moves/s')
+
+    def possible_moves():
+        for game in positions:
+            game.possible_moves()
+        return len(positions)
+    results['possible_moves'] = (measure(possible_moves, min_time), 'calls/s')
+
+    def can_move():
+        for game in positions:
+            game.can_move()
+        return len(positions)
+    results['can_move'] = (measure(can_move, min_time), 'calls/s')
+
+    def evaluate():
+        for game in positions:
+            evaluate_state(game)
+        return len(positions)
+    results['evaluate_state'] = (measure(evaluate, min_time), 'evals/s')
+    return results
+
+def search_benchmarks(positions, min_time, depths=(3, 5), mcts_iterations=200):
+    results = {}
+    for depth in depths:
+        searched = positions[:8] if depth <= 3 else positions[:2] #depth 5 is ~50x the work of depth 3
+        def search(depth=depth, searched=searched):
+            nodes = 0
+            for game in searched:
+                budget = SearchBudget() #only counts nodes, no limit
+                expectimax_policy(game, depth, TranspositionTable(), budget)
+                nodes += budget.nodes
+            return nodes
+        results[f'expectimax_depth{depth}'] = (measure(search, min_time, rounds=1), 'nodes/s')
+
+    def playouts():
+        total = 0
+        for index, game in enumerate(positions[:4]):
+            root = mcts_search(game, None, 1, None, mcts_iterations, random.Random(index))
+            total += root.n
+        return total
+    results['mcts_policy'] = (measure(playouts, min_time, rounds=1), 'playouts/s')
+
+    for policy in PLAYOUTS: #rollouts from the root only, so this is the playout policy alone without the tree
+        def rollouts(policy=policy):
+            playout = Playout(policy)
+            for index, game in enumerate(positions[:4]):
+                playout.run(Node(game.bitboard, game.score, is_chance_node=False), 16, random.Random(index))
+            return playout.rollouts
+        results[f'playout_{policy}'] = (measure(rollouts, min_time), 'rollouts/s')
+    return results
+
+def compare(results, baseline, tolerance): #returns [(name, current, baseline, ratio)] for everything slower than baseline * (1 - tolerance)
+    regressions = []
+    for name, entry in results.items():
+        if name not in baseline:
+            continue
+        ratio = entry['rate'] / baseline[name]['rate']
+        if ratio < 1 - tolerance:
+            regressions.append((name, entry['rate'], baseline[name]['rate'], ratio))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the 2048 engine and agents.")
+    parser.add_argument("--output", default="bench_results.json", help="where to write this run's results")
+    parser.add_argument("--baseline", default="bench_baseline.json", help="baseline to compare against (one entry per interpreter)")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline for the current interpreter")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="fraction slower than the baseline that counts as a regression")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds each measurement runs for at least")
+    parser.add_argument("--quick", action="store_true", help="engine primitives and depth 3 only")
+    parser.add_argument("--size", type=int, default=4, help="board size to benchmark")
+    args = parser.parse_args()
+
+    set_board_size(args.size)
+    implementation = platform.python_implementation()
+    if args.size != 4:
+        implementation += f" {args.size}x{args.size}"
+    positions = fixed_positions()
+    timings = engine_benchmarks(positions, args.min_time)
+    timings.update(search_benchmarks(positions, args.min_time, depths=(3,) if args.quick else (3, 5)))
+
+    results = {name: {'rate': rate, 'unit': unit} for name, (rate, unit) in timings.items()}
+    run = {'implementation': implementation, 'python': platform.python_version(), 'time': time.time(), 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(run, f, indent=2)
+
+    for name, entry in results.items():
+        print(f"{name:<22} {entry['rate']:>14,.0f} {entry['unit']}")
+    print(f"Results written to {args.output} ({implementation} {platform.python_version()})")
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    if args.save_baseline:
+        baselines[implementation] = run
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2)
+        print(f"Saved as the {implementation} baseline in {args.baseline}")
+        return
+
+    if implementation not in baselines:
+        print(f"No {implementation} baseline in {args.baseline}, run with --save-baseline to store one")
+        return
+    regressions = compare(results, baselines[implementation]['results'], args.tolerance)
+    for name, current, base, ratio in regressions:
+        print(f"REGRESSION {name}: {current:,.0f} vs baseline {base:,.0f} ({ratio:.0%})")
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions against the {implementation} baseline (tolerance {args.tolerance:.0%})")
+
+if __name__ == "__main__":
+    main()
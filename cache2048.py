@@ -0,0 +1,215 @@
+import argparse
+import mmap
+import os
+import struct
+import zlib
+from collections import defaultdict
+
+"""
+Persistent expectimax value cache shared by every process and every run that opens the same file:
+
+    python game2048.py 100 5 --cache runs/values.cache                      #games read and extend the cache as they search
+    python cache2048.py warm runs/values.cache --trajectories runs/games     #search recorded positions offline to fill it
+    python cache2048.py stats runs/values.cache
+
+The file is a fixed layout hash table that every process memory maps, so a value one worker solved is a hit for all the others:
+    header   magic, slot count (u64), generation (u16), tag (32 bytes), padded to 64 bytes
+    slots    24 bytes each: check (u64), value (f64 bits), meta (u64: depth | generation << 8), little endian
+Slots are grouped in buckets of 4, a (board, depth) can live in any slot of its bucket. Writes aren't locked, instead check is
+board ^ value ^ meta so a slot torn by two processes writing at once no longer verifies and reads as a miss.
+Values are relative to the score, like TranspositionTable, and the tag records the evaluator and pruning options that produced them.
+"""
+
+MAGIC = b'2048TTC1'
+HEADER = struct.Struct('<8sQH32s')
+HEADER_SIZE = 64
+SLOT = struct.Struct('<QQQ')
+VALUE = struct.Struct('<d')
+BUCKET = 4
+POLICIES = ['depth', 'age']
+MASK64 = (1 << 64) - 1
+
+class SharedCache: #(board, depth) -> value relative to the score, see the layout above
+    def __init__(self, path, tag, slots=1 << 20, policy='depth', min_depth=2):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        tag = tag.encode()[:32].ljust(32, b'\0')
+        if not os.path.exists(path):
+            create_cache(path, slots, tag)
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, self.slots, self.generation, file_tag = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a value cache")
+        if file_tag != tag: #values from another evaluator or pruning setup would be wrong, not just stale
+            raise ValueError(f"{path} was built with {tag_name(file_tag)!r}, not {tag_name(tag)!r}, use another file")
+        self.path = path
+        self.policy = policy #depth: evict the shallowest entry of the bucket, age: evict the one written the longest ago
+        self.min_depth = min_depth #shallower values are cheaper to recompute than to share
+        self.shift = 64 - (self.slots.bit_length() - 1)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def next_generation(self): #called once per run, age eviction then prefers entries of older runs
+        self.generation = (self.generation + 1) & 0xFFFF
+        HEADER.pack_into(self.map, 0, MAGIC, self.slots, self.generation, HEADER.unpack_from(self.map, 0)[3])
+
+    def bucket(self, board, depth): #offset of the first slot of the bucket
+        index = (((board ^ (depth << 56)) * 0x9E3779B97F4A7C15) & MASK64) >> self.shift
+        return HEADER_SIZE + (index & ~(BUCKET - 1)) * SLOT.size
+
+    def get(self, board, depth):
+        offset = self.bucket(board, depth)
+        for _ in range(BUCKET):
+            check, bits, meta = SLOT.unpack_from(self.map, offset)
+            if meta & 0xFF == depth and check ^ bits ^ meta == board:
+                self.hits += 1
+                return VALUE.unpack(bits.to_bytes(8, 'little'))[0]
+            offset += SLOT.size
+        self.misses += 1
+        return None
+
+    def store(self, board, depth, value):
+        if depth < self.min_depth:
+            return
+        bits = int.from_bytes(VALUE.pack(value), 'little')
+        meta = depth | (self.generation << 8)
+        offset = self.bucket(board, depth)
+        victim = None
+        for _ in range(BUCKET):
+            check, old_bits, old_meta = SLOT.unpack_from(self.map, offset)
+            if not old_meta or (old_meta & 0xFF == depth and check ^ old_bits ^ old_meta == board): #empty or the same entry
+                victim = offset
+                break
+            age = (self.generation - (old_meta >> 8)) & 0xFFFF
+            rank = (old_meta & 0xFF, -age) if self.policy == 'depth' else (-age, old_meta & 0xFF)
+            if victim is None or rank < victim_rank:
+                victim = offset
+                victim_rank = rank
+            offset += SLOT.size
+        else:
+            self.evictions += 1
+        SLOT.pack_into(self.map, victim, board ^ bits ^ meta, bits, meta)
+        self.stores += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'stores': self.stores, 'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def contents(self): #scans the whole file, for the stats command
+        by_depth = defaultdict(int)
+        by_generation = defaultdict(int)
+        for offset in range(HEADER_SIZE, HEADER_SIZE + self.slots * SLOT.size, SLOT.size):
+            check, bits, meta = SLOT.unpack_from(self.map, offset)
+            if meta:
+                by_depth[meta & 0xFF] += 1
+                by_generation[meta >> 8] += 1
+        return {'slots': self.slots, 'used': sum(by_depth.values()), 'generation': self.generation,
+                'by_depth': dict(sorted(by_depth.items())), 'by_generation': dict(sorted(by_generation.items()))}
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+def create_cache(path, slots, tag): #written under a temporary name and renamed so a process never maps a half made file
+    slots = max(BUCKET, 1 << (slots - 1).bit_length()) #power of two so the hash is a shift
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, slots, 0, tag).ljust(HEADER_SIZE, b'\0'))
+        f.truncate(HEADER_SIZE + slots * SLOT.size) #sparse zeros, every slot starts empty
+    os.replace(temporary, path)
+
+def cache_tag(evaluator, prob_cutoff=0.0, max_spawns=None):
+    tag = f"{getattr(evaluator, 'name', type(evaluator).__name__)} p{prob_cutoff:g} s{max_spawns or 0}"
+    if len(tag.encode()) > 32: #too long for the header, keep the start readable and a checksum of the whole tag so different tags still differ
+        tag = f"{tag.encode()[:23].decode(errors='ignore')} {zlib.crc32(tag.encode()):08x}"
+    return tag
+
+def tag_name(tag):
+    return tag.rstrip(b'\0').decode()
+
+def warm_positions(trajectories=None, every=1, games=32, seed=2048): #boards to search offline, from recorded games or seeded greedy games
+    from game2048 import Game2048
+    from trajectory2048 import read_trajectories, replay
+    if trajectories:
+        for trajectory in read_trajectories(trajectories):
+            for index, (board, score, move) in enumerate(replay(trajectory)):
+                if move is not None and not index % every:
+                    yield board, score
+        return
+    for game_number in range(games):
+        game = Game2048(seed + game_number)
+        while game.can_move():
+            if not game.moves % every:
+                yield game.bitboard, game.score
+            game.next_state(['w', 'a', 's', 'd'][game.greedy_moves()])
+            game.moves += 1
+
+def warm_chunk(path, positions, depth, slots, policy, tt_size): #runs in a worker, searches every position with the cache behind its table
+    import game2048
+    cache = game2048.get_shared_cache(path, slots, policy)
+    table = game2048.TranspositionTable(tt_size, shared=cache)
+    state = game2048.Game2048(0)
+    for board, score in positions:
+        state.bitboard = board
+        state.score = score
+        game2048.expectimax_policy(state, depth, table)
+    return cache.stats()
+
+def warm(path, positions, depth=5, slots=1 << 20, policy='depth', workers=1, chunk=64, tt_size=200000):
+    from concurrent.futures import ProcessPoolExecutor
+    import game2048
+    game2048.get_shared_cache(path, slots, policy).next_generation() #created here, before any worker maps it
+    totals = defaultdict(int)
+    chunks = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for board, score in positions:
+            chunks.append((board, score))
+            if len(chunks) == chunk:
+                futures.append(executor.submit(warm_chunk, path, chunks, depth, slots, policy, tt_size))
+                chunks = []
+        if chunks:
+            futures.append(executor.submit(warm_chunk, path, chunks, depth, slots, policy, tt_size))
+        for future in futures:
+            for key, value in future.result().items():
+                totals[key] += value
+    return dict(totals)
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm or inspect a shared expectimax value cache.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    warm_parser = commands.add_parser("warm", help="search positions offline and store their values")
+    warm_parser.add_argument("cache", help="cache file, created if it doesn't exist")
+    warm_parser.add_argument("--trajectories", nargs='+', help="trajectory files or directories to take positions from (default: seeded greedy games)")
+    warm_parser.add_argument("--every", type=int, default=1, help="only search every n-th position of each game")
+    warm_parser.add_argument("--games", type=int, default=32, help="greedy games to take positions from without --trajectories")
+    warm_parser.add_argument("--depth", type=int, default=5, help="expectimax depth to search each position to")
+    warm_parser.add_argument("--slots", type=int, default=1 << 20, help="slots in a new cache file (24 bytes each)")
+    warm_parser.add_argument("--policy", choices=POLICIES, default='depth', help="eviction: shallowest entry or oldest run first")
+    warm_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    stats_parser = commands.add_parser("stats", help="print how full the cache is by depth and run")
+    stats_parser.add_argument("cache")
+    args = parser.parse_args()
+    if args.command == "warm" and (args.depth < 1 or args.depth % 2 == 0): #see game2048.check_depth
+        parser.error("--depth must be odd and at least 1")
+
+    if args.command == "stats":
+        with open(args.cache, 'rb') as f:
+            magic, slots, generation, tag = HEADER.unpack(f.read(HEADER.size))
+        cache = SharedCache(args.cache, tag_name(tag))
+        contents = cache.contents()
+        print(f"{args.cache}: {tag_name(tag)}, {contents['used']} of {contents['slots']} slots used ({contents['used'] / contents['slots']:.1%}), generation {contents['generation']}")
+        print(f"By Depth: {contents['by_depth']}")
+        print(f"By Generation: {contents['by_generation']}")
+        return
+
+    positions = warm_positions(args.trajectories, args.every, args.games)
+    totals = warm(args.cache, positions, args.depth, args.slots, args.policy, args.workers)
+    print(f"Warmed {args.cache}: {totals.get('stores', 0)} stores, {totals.get('hits', 0)} hits, {totals.get('evictions', 0)} evictions")
+
+if __name__ == "__main__":
+    main()
@@ -2,77 +2,846 @@ import random
 import argparse
 import time
 import math
-import copy
-from collections import defaultdict
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import csv
+import json
+import os
+from itertools import islice
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+#bitboard engine: the whole board is packed into one 64 bit int, 4 bits per cell holding the tile exponent (0 = empty, 1 = 2, 2 = 4, ...)
+#row r lives in bits 16*r .. 16*r + 15 and column c of that row in bits 4*c .. 4*c + 3 so cell (r, c) is at shift 4 * (4*r + c)
+#other board sizes use the same layout with 4 * size bits per row, see board_functions and set_board_size
+
+MOVES = ['w', 'a', 's', 'd']
+ROW_MASK = 0xFFFF
+EMPTY_MASK = 0x1111111111111111 #lowest bit of every cell
+MAX_EXPONENT = 15 #largest exponent a 4 bit cell can hold (32768)
+
+def slide_row_exponents(cells): #slides a row of exponents to the left, returns (new row, score gained)
+    tiles = [e for e in cells if e != 0]
+    new_row = []
+    gained = 0
+    i = 0
+    while i < len(tiles):
+        if i + 1 < len(tiles) and tiles[i] == tiles[i + 1] and tiles[i] < MAX_EXPONENT: #each tile can only merge once per move
+            new_row.append(tiles[i] + 1)
+            gained += 1 << (tiles[i] + 1)
+            i += 2
+        else:
+            new_row.append(tiles[i])
+            i += 1
+    return new_row + [0] * (len(cells) - len(new_row)), gained
+
+def pack_row(cells):
+    return cells[0] | (cells[1] << 4) | (cells[2] << 8) | (cells[3] << 12)
+
+def unpack_row(row):
+    return [row & 0xF, (row >> 4) & 0xF, (row >> 8) & 0xF, (row >> 12) & 0xF]
+
+def unpack_col(row): #spreads a 16 bit row out into a column (one nibble per 16 bit row)
+    return (row & 0xF) | ((row & 0xF0) << 12) | ((row & 0xF00) << 24) | ((row & 0xF000) << 36)
+
+def build_row_tables(): #precompute left/right slides, score gains, max tile and tile sum for all 65536 possible rows
+    row_left = [0] * 65536
+    row_right = [0] * 65536
+    score_left = [0] * 65536
+    score_right = [0] * 65536
+    row_max = [0] * 65536
+    row_sum = [0] * 65536
+    for row in range(65536):
+        cells = unpack_row(row)
+        left, gained = slide_row_exponents(cells)
+        right, gained_right = slide_row_exponents(cells[::-1])
+        row_left[row] = pack_row(left)
+        row_right[row] = pack_row(right[::-1])
+        score_left[row] = gained
+        score_right[row] = gained_right
+        row_max[row] = max(cells)
+        row_sum[row] = sum(1 << e for e in cells if e)
+    col_up = [unpack_col(row) for row in row_left] #up/down are left/right on the transposed board
+    col_down = [unpack_col(row) for row in row_right]
+    return row_left, row_right, score_left, score_right, col_up, col_down, row_max, row_sum
+
+ROW_LEFT, ROW_RIGHT, SCORE_LEFT, SCORE_RIGHT, COL_UP, COL_DOWN, ROW_MAX, ROW_SUM = build_row_tables()
+
+def transpose(b): #swap rows and columns with two rounds of masked shifts
+    a1 = b & 0xF0F00F0FF0F00F0F
+    a2 = b & 0x0000F0F00000F0F0
+    a3 = b & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+#each slide returns (new board, score gained)
+def slide_bits_left(b):
+    r0 = b & ROW_MASK
+    r1 = (b >> 16) & ROW_MASK
+    r2 = (b >> 32) & ROW_MASK
+    r3 = b >> 48
+    return (ROW_LEFT[r0] | (ROW_LEFT[r1] << 16) | (ROW_LEFT[r2] << 32) | (ROW_LEFT[r3] << 48),
+            SCORE_LEFT[r0] + SCORE_LEFT[r1] + SCORE_LEFT[r2] + SCORE_LEFT[r3])
+
+def slide_bits_right(b):
+    r0 = b & ROW_MASK
+    r1 = (b >> 16) & ROW_MASK
+    r2 = (b >> 32) & ROW_MASK
+    r3 = b >> 48
+    return (ROW_RIGHT[r0] | (ROW_RIGHT[r1] << 16) | (ROW_RIGHT[r2] << 32) | (ROW_RIGHT[r3] << 48),
+            SCORE_RIGHT[r0] + SCORE_RIGHT[r1] + SCORE_RIGHT[r2] + SCORE_RIGHT[r3])
+
+def slide_bits_up(b):
+    t = transpose(b)
+    c0 = t & ROW_MASK
+    c1 = (t >> 16) & ROW_MASK
+    c2 = (t >> 32) & ROW_MASK
+    c3 = t >> 48
+    return (COL_UP[c0] | (COL_UP[c1] << 4) | (COL_UP[c2] << 8) | (COL_UP[c3] << 12),
+            SCORE_LEFT[c0] + SCORE_LEFT[c1] + SCORE_LEFT[c2] + SCORE_LEFT[c3])
+
+def slide_bits_down(b):
+    t = transpose(b)
+    c0 = t & ROW_MASK
+    c1 = (t >> 16) & ROW_MASK
+    c2 = (t >> 32) & ROW_MASK
+    c3 = t >> 48
+    return (COL_DOWN[c0] | (COL_DOWN[c1] << 4) | (COL_DOWN[c2] << 8) | (COL_DOWN[c3] << 12),
+            SCORE_RIGHT[c0] + SCORE_RIGHT[c1] + SCORE_RIGHT[c2] + SCORE_RIGHT[c3])
+
+SLIDES = [slide_bits_up, slide_bits_left, slide_bits_down, slide_bits_right] #same order as MOVES
+
+def successors_bits(b): #every legal move with its resulting board and score gained, in one pass over the four slides
+    result = []
+    for move, slide in zip(MOVES, SLIDES):
+        new_board, gained = slide(b)
+        if new_board != b:
+            result.append((move, new_board, gained))
+    return result
+
+def empty_mask(b): #1 in the lowest bit of every empty cell
+    b |= b >> 2
+    b |= b >> 1
+    return ~b & EMPTY_MASK
+
+def empty_cells(b): #shifts of the empty cells in row major order
+    cells = []
+    m = empty_mask(b)
+    while m:
+        low = m & -m
+        cells.append(low.bit_length() - 1)
+        m ^= low
+    return cells
+
+def max_exponent(b):
+    return max(ROW_MAX[b & ROW_MASK], ROW_MAX[(b >> 16) & ROW_MASK], ROW_MAX[(b >> 32) & ROW_MASK], ROW_MAX[b >> 48])
+
+def tile_sum(b):
+    return ROW_SUM[b & ROW_MASK] + ROW_SUM[(b >> 16) & ROW_MASK] + ROW_SUM[(b >> 32) & ROW_MASK] + ROW_SUM[b >> 48]
+
+def can_move_bits(b):
+    if empty_mask(b):
+        return True
+    #on a full board left/right (and up/down) change the board exactly when there is an equal neighbor pair
+    return slide_bits_left(b)[0] != b or slide_bits_up(b)[0] != b
+
+def board_to_bits(board):
+    b = 0
+    for r in range(board_size):
+        for c in range(board_size):
+            if board[r][c]:
+                b |= (board[r][c].bit_length() - 1) << (4 * (board_size * r + c))
+    return b
+
+def bits_to_board(b):
+    return [[(1 << e) if e else 0 for e in unpack_cells(b >> (4 * board_size * r), board_size)] for r in range(board_size)]
+
+#any other size: same packing with rows of 4 * size bits, the slides loop over the rows instead of being unrolled
+#a row space of up to 16 ** 4 rows is precomputed like the 4x4 tables, past that the tables fill in the rows as they are seen
+PRECOMPUTED_ROW_CELLS = 4
+
+def unpack_cells(row, size): #exponents of the first size cells of row
+    return [(row >> (4 * c)) & 0xF for c in range(size)]
+
+def pack_cells(cells):
+    row = 0
+    for c, e in enumerate(cells):
+        row |= e << (4 * c)
+    return row
+
+class LazyRowTable(dict): #read like a row table list, each row is computed the first time it is looked up
+    def __init__(self, compute):
+        super().__init__()
+        self.compute = compute
+
+    def __missing__(self, row):
+        value = self[row] = self.compute(row)
+        return value
+
+def row_table(size, compute): #compute(row) for every row of size cells, a list when the row space is small enough, LazyRowTable otherwise
+    if size <= PRECOMPUTED_ROW_CELLS:
+        return [compute(row) for row in range(16 ** size)]
+    return LazyRowTable(compute)
+
+def board_functions(size): #the size specific engine functions for size x size boards, by the names set_board_size rebinds
+    row_bits = 4 * size
+    row_mask = (1 << row_bits) - 1
+    row_shifts = [row_bits * r for r in range(size)]
+    col_shifts = list(zip(row_shifts, range(0, row_bits, 4))) #row c of the transposed board goes back to column c
+    def slide_left_cells(row):
+        return slide_row_exponents(unpack_cells(row, size))
+    def slide_right_cells(row):
+        new_row, gained = slide_row_exponents(unpack_cells(row, size)[::-1])
+        return new_row[::-1], gained
+    def spread(row): #row moved into a column, one cell per row of the board
+        col = 0
+        for shift, offset in col_shifts:
+            col |= ((row >> offset) & 0xF) << shift
+        return col
+    row_left = row_table(size, lambda row: pack_cells(slide_left_cells(row)[0]))
+    row_right = row_table(size, lambda row: pack_cells(slide_right_cells(row)[0]))
+    score_left = row_table(size, lambda row: slide_left_cells(row)[1])
+    score_right = row_table(size, lambda row: slide_right_cells(row)[1])
+    col_up = row_table(size, lambda row: spread(row_left[row]))
+    col_down = row_table(size, lambda row: spread(row_right[row]))
+    spread_row = row_table(size, spread)
+    row_max = row_table(size, lambda row: max(unpack_cells(row, size)))
+    row_sum = row_table(size, lambda row: sum(1 << e for e in unpack_cells(row, size) if e))
+
+    def transpose(b):
+        t = 0
+        for shift, offset in col_shifts:
+            t |= spread_row[(b >> shift) & row_mask] << offset
+        return t
+
+    def slide_rows(b, rows, scores):
+        new_board = 0
+        gained = 0
+        for shift in row_shifts:
+            row = (b >> shift) & row_mask
+            new_board |= rows[row] << shift
+            gained += scores[row]
+        return new_board, gained
+
+    def slide_cols(b, cols, scores):
+        t = transpose(b)
+        new_board = 0
+        gained = 0
+        for shift, offset in col_shifts:
+            col = (t >> shift) & row_mask
+            new_board |= cols[col] << offset
+            gained += scores[col]
+        return new_board, gained
+
+    def slide_bits_left(b):
+        return slide_rows(b, row_left, score_left)
+
+    def slide_bits_right(b):
+        return slide_rows(b, row_right, score_right)
+
+    def slide_bits_up(b):
+        return slide_cols(b, col_up, score_left)
+
+    def slide_bits_down(b):
+        return slide_cols(b, col_down, score_right)
+
+    def max_exponent(b):
+        highest = 0
+        for shift in row_shifts:
+            highest = max(highest, row_max[(b >> shift) & row_mask])
+        return highest
+
+    def tile_sum(b):
+        total = 0
+        for shift in row_shifts:
+            total += row_sum[(b >> shift) & row_mask]
+        return total
+
+    return {'EMPTY_MASK': sum(1 << (4 * cell) for cell in range(size * size)), 'transpose': transpose,
+            'slide_bits_up': slide_bits_up, 'slide_bits_left': slide_bits_left, 'slide_bits_down': slide_bits_down, 'slide_bits_right': slide_bits_right,
+            'SLIDES': [slide_bits_up, slide_bits_left, slide_bits_down, slide_bits_right], 'max_exponent': max_exponent, 'tile_sum': tile_sum}
+
+#engine functions of every size used so far, starting with the 4x4 ones above so set_board_size(4) can switch back to them
+board_engines = {4: {'EMPTY_MASK': EMPTY_MASK, 'transpose': transpose, 'slide_bits_up': slide_bits_up, 'slide_bits_left': slide_bits_left,
+                  'slide_bits_down': slide_bits_down, 'slide_bits_right': slide_bits_right, 'SLIDES': SLIDES, 'max_exponent': max_exponent, 'tile_sum': tile_sum}}
+
+##################################################################################################################################################################################
+##################################################################################################################################################################################
+##################################################################################################################################################################################
+
+POSITION_WEIGHT = [ #snake weight value
+    [8192, 16384, 32768, 65536],
+    [4096,  2048,  1024,  512,],
+    [32,     64,   128,   256],
+    [16,     8,      4,     2]
+]
+
+position_weights = {4: POSITION_WEIGHT}
+
+def snake_weights(size): #POSITION_WEIGHT for any size: powers of 2 falling along a snake that starts in the top right corner
+    if size not in position_weights:
+        weights = [[0] * size for _ in range(size)]
+        for k in range(size * size):
+            r, i = divmod(k, size)
+            weights[r][size - 1 - i if r % 2 == 0 else i] = 1 << (size * size - k)
+        position_weights[size] = weights
+    return position_weights[size]
+
+#heuristic terms score one line of the board (exponents, index of the row or column) and are precomputed for every possible line (see row_table)
+def snake_term(cells, index): #tile values weighted by position_weight, only meaningful for rows
+    weights = snake_weights(len(cells))[index]
+    value = 0
+    for c in range(len(cells)):
+        if cells[c]:
+            value += (1 << cells[c]) * weights[c]
+    return value
+
+def empty_term(cells, index):
+    return cells.count(0)
+
+def merge_term(cells, index): #number of neighboring pairs that could merge
+    return sum(1 for a, b in zip(cells, cells[1:]) if a and a == b)
+
+def monotonicity_term(cells, index): #0 for a monotone line, more negative the more it zig zags
+    increasing = sum(b - a for a, b in zip(cells, cells[1:]) if b > a)
+    decreasing = sum(a - b for a, b in zip(cells, cells[1:]) if a > b)
+    return -min(increasing, decreasing)
+
+class TableEvaluator: #heuristic that is a sum of per-row and per-column terms, so a leaf costs a handful of table lookups
+    def __init__(self, row_terms, col_terms=(), score_weight=1, bounds=None, size=4):
+        #row_terms/col_terms are (weight, term) pairs, columns are read top to bottom
+        #bounds(board, score, depth) -> (lower, upper) on any value a search of that depth can return, needed for star pruning
+        self.score_weight = score_weight
+        #identifies the heuristic in a cache2048 tag, e.g. "Table4x4 1*snake" or "Table4x4 1*snake col:2*merge score*0.5"
+        terms = [f"{weight:g}*{term.__name__.replace('_term', '')}" for weight, term in row_terms]
+        terms += [f"col:{weight:g}*{term.__name__.replace('_term', '')}" for weight, term in col_terms]
+        self.name = f"Table{size}x{size} {' '.join(terms)}" + (f" score*{score_weight:g}" if score_weight != 1 else "")
+        self.bounds = bounds
+        self.size = size #only boards of this size, the transpose of other sizes comes from set_board_size
+        self.row_tables = self.build_tables(row_terms, size)
+        self.col_tables = self.build_tables(col_terms, size) if col_terms else None
+
+    @staticmethod
+    def build_tables(terms, size=4): #one table per row (or column) index
+        def compute(cells, index):
+            value = 0
+            for weight, term in terms:
+                value += weight * term(cells, index)
+            return value
+        if size > PRECOMPUTED_ROW_CELLS: #see row_table
+            return [LazyRowTable(lambda row, index=index: compute(unpack_cells(row, size), index)) for index in range(size)]
+        tables = [[0] * 16 ** size for _ in range(size)]
+        for row in range(16 ** size):
+            cells = unpack_cells(row, size)
+            for index in range(size):
+                tables[index][row] = compute(cells, index)
+        return tables
+
+    def evaluate_rows(self, board, score): #__call__ for sizes other than 4, one lookup per row and column
+        row_bits = 4 * self.size
+        row_mask = (1 << row_bits) - 1
+        value = self.score_weight * score
+        for index, table in enumerate(self.row_tables):
+            value += table[(board >> (row_bits * index)) & row_mask]
+        if self.col_tables:
+            t = transpose(board)
+            for index, table in enumerate(self.col_tables):
+                value += table[(t >> (row_bits * index)) & row_mask]
+        return value
+
+    def __call__(self, board, score):
+        if self.size != 4:
+            return self.evaluate_rows(board, score)
+        t0, t1, t2, t3 = self.row_tables
+        value = self.score_weight * score + t0[board & ROW_MASK] + t1[(board >> 16) & ROW_MASK] + t2[(board >> 32) & ROW_MASK] + t3[board >> 48]
+        if self.col_tables:
+            t = transpose(board)
+            c0, c1, c2, c3 = self.col_tables
+            value += c0[t & ROW_MASK] + c1[(t >> 16) & ROW_MASK] + c2[(t >> 32) & ROW_MASK] + c3[t >> 48]
+        return value
+
+def snake_bounds(board, score, depth):
+    #tiles never disappear, merges keep the tile sum and each spawn adds 2, so the tile sum bounds both the weighted sum and the score a move can gain
+    moves = (depth + 1) // 2
+    spawns = depth // 2
+    tiles = tile_sum(board)
+    max_tiles = tiles + 2 * spawns
+    weights = snake_weights(board_size)
+    lower = score + tiles * min(min(row) for row in weights)
+    upper = score + moves * max_tiles + max_tiles * max(max(row) for row in weights)
+    return lower, upper
+
+SNAKE_EVALUATOR = TableEvaluator([(1, snake_term)], bounds=snake_bounds) #curr_score(short term) + snake weight score (long_term)
+snake_evaluators = {4: SNAKE_EVALUATOR} #built on first use of each board size
+evaluator = SNAKE_EVALUATOR
+
+def set_evaluator(new_evaluator): #any callable (board, score) -> value works, the transposition table assumes it is score + f(board)
+    global evaluator
+    evaluator = new_evaluator
+
+ntuple_path = None #weights file of the n-tuple evaluator in use, worker pools load the same one
+
+def use_ntuple(path): #swaps the evaluator for an n-tuple network trained by ntuple2048.py, the weights are memory mapped
+    global ntuple_path
+    from ntuple2048 import load_network
+    if board_size != 4:
+        raise ValueError("n-tuple networks are trained on 4x4 boards")
+    set_evaluator(load_network(path))
+    ntuple_path = path
+
+board_size = 4 #side of the board every game and search in this process plays on, see set_board_size
+
+def set_board_size(size):
+    #one board size per process, like the evaluator: rebinds the engine functions and the snake heuristic so the search code
+    #calls the size specific ones directly, and 4x4 keeps its unrolled functions without paying for the option
+    #games made before the switch would be played with the new size's tables, so only call it before making any game
+    #(main(), init_worker and the entry points of worker jobs)
+    global board_size, evaluator, PLAYOUT_ORDER
+    if size == board_size:
+        return
+    if size < 2:
+        raise ValueError(f"Board size must be at least 2, not {size}")
+    if ntuple_path is not None:
+        raise ValueError("n-tuple networks are trained on 4x4 boards")
+    if size not in board_engines:
+        board_engines[size] = board_functions(size)
+    globals().update(board_engines[size])
+    if size not in snake_evaluators:
+        snake_evaluators[size] = TableEvaluator([(1, snake_term)], bounds=snake_bounds, size=size)
+    evaluator = snake_evaluators[size]
+    PLAYOUT_ORDER = [SLIDES[0], SLIDES[3], SLIDES[1], SLIDES[2]]
+    board_size = size
+
+def init_worker(size, path):
+    set_board_size(size)
+    if path is not None:
+        use_ntuple(path)
+
+def worker_initializer(): #(initializer, initargs) that gives a new worker process the board size and evaluator of this one
+    if ntuple_path is None and board_size == 4:
+        return None, ()
+    return init_worker, (board_size, ntuple_path)
+
+def evaluate_board(board, score): #search works on bare (board, score) values so it never has to copy a Game2048
+    if instrument is not None:
+        instrument.evaluations += 1
+    return evaluator(board, score)
 
 def evaluate_state(state):
-    position_weight = [ #snake weight value
-        [8192, 16384, 32768, 65536],
-        [4096,  2048,  1024,  512,],
-        [32,     64,   128,   256],
-        [16,     8,      4,     2]
-    ]
-    
-    weighted_sum = 0
-    for r in range(state.size):
-        for c in range(state.size):
-            weighted_sum += state.board[r][c] * position_weight[r][c]
-    
-    return state.score + weighted_sum  #combine curr_score(short term) with snake weight score (long_term)
+    return evaluate_board(state.bitboard, state.score)
+
+class TranspositionTable: #memoizes expectimax values keyed on (board, remaining depth, node type), lives for a whole game
+    def __init__(self, max_entries=200000, policy='lru', shared=None):
+        if policy not in ('lru', 'depth'):
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        self.max_entries = max_entries
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries = OrderedDict() #lru: key -> value, oldest first
+        self.slots = [None] * max_entries if policy == 'depth' else None #depth: fixed slots of (key, depth, value)
+        self.shared = shared #optional cache2048.SharedCache behind this table, shared by every process and run using the same file
+        self.shared_hits = 0
+
+    def get(self, board, depth, node_type):
+        key = (board << 8) | (depth << 1) | node_type
+        if self.policy == 'lru':
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+        else:
+            entry = self.slots[hash(key) % self.max_entries]
+            value = entry[2] if entry is not None and entry[0] == key else None
+        if value is None and self.shared is not None: #depth already says the node type
+            value = self.shared.get(board, depth)
+            if value is not None:
+                self.shared_hits += 1
+                self.store(board, depth, node_type, value, False)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def store(self, board, depth, node_type, value, share=True):
+        if share and self.shared is not None:
+            self.shared.store(board, depth, value)
+        key = (board << 8) | (depth << 1) | node_type
+        if self.policy == 'lru':
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            slot = hash(key) % self.max_entries
+            entry = self.slots[slot]
+            if entry is None or entry[0] == key:
+                self.slots[slot] = (key, depth, value)
+            elif depth >= entry[1]: #depth preferred: a deeper search is worth more than a shallow one
+                self.slots[slot] = (key, depth, value)
+                self.evictions += 1
+
+    def __len__(self):
+        if self.policy == 'lru':
+            return len(self.entries)
+        return sum(1 for entry in self.slots if entry is not None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': len(self),
+                'hit_rate': self.hits / lookups if lookups else 0.0, 'shared_hits': self.shared_hits}
+
+shared_caches = {} #every process maps each cache file once, keyed by the options its values depend on
+
+def get_shared_cache(path, slots=1 << 20, policy='depth', prob_cutoff=0.0, max_spawns=None):
+    key = (path, prob_cutoff, max_spawns)
+    if key not in shared_caches:
+        from cache2048 import SharedCache, cache_tag
+        shared_caches[key] = SharedCache(path, cache_tag(evaluator, prob_cutoff, max_spawns), slots, policy)
+    return shared_caches[key]
+
+EXPECTIMAX_DEPTH = 5 #odd depths end on a max node, 5 is affordable with the transposition table
+MAX_ITERATIVE_DEPTH = 15 #iterative deepening never goes past this
+ADAPTIVE_DEPTHS = [(7, 3), (3, 5), (0, 7)] #(min empty cells, depth), chance nodes are cheap when the board is nearly full
+
+def adaptive_depth(board): #fewer empty cells means fewer spawns to average over, so we can afford to look further
+    empty = bin(empty_mask(board)).count('1')
+    for min_empty, depth in ADAPTIVE_DEPTHS:
+        if empty >= min_empty:
+            return depth
+    return EXPECTIMAX_DEPTH
+
+class SearchTimeout(Exception): #raised inside expectimax when the per-move budget runs out
+    pass
+
+class SearchBudget: #per-move time and/or node budget, checked at every expectimax node
+    def __init__(self, time_budget=None, node_budget=None):
+        self.deadline = time.time() + time_budget if time_budget is not None else None
+        self.node_budget = node_budget
+        self.nodes = 0
+
+    def tick(self):
+        self.nodes += 1
+        if self.node_budget is not None and self.nodes > self.node_budget:
+            raise SearchTimeout()
+        if self.deadline is not None and not self.nodes & 255 and time.time() > self.deadline: #time.time() is too slow to call at every node
+            raise SearchTimeout()
+
+class Pruning: #chance node pruning options and how many subtrees of each depth every option skipped
+    def __init__(self, prob_cutoff=0.0, max_spawns=None, star=0):
+        if star and getattr(evaluator, 'bounds', None) is None:
+            raise ValueError("Star pruning needs an evaluator with bounds")
+        self.prob_cutoff = prob_cutoff #subtrees reached with a lower probability fall back to evaluate_state
+        self.max_spawns = max_spawns #most spawn cells expanded per chance node
+        self.star = star #1: Star1 bound cutoffs at chance nodes, 2: also probe max node children in heuristic order
+        self.skipped = {'prob': defaultdict(int), 'spawns': defaultdict(int), 'star': defaultdict(int)}
+
+    def stats(self):
+        return {option: {'subtrees': sum(by_depth.values()), 'by_depth': dict(by_depth)} for option, by_depth in self.skipped.items()}
+
+class Histogram: #log scale buckets, 10 per decade, so merged histograms of any size keep percentiles within ~25%
+    def __init__(self):
+        self.buckets = defaultdict(int) #bucket k counts the values in (10 ** ((k - 1) / 10), 10 ** (k / 10)]
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.buckets[math.ceil(math.log10(max(value, 1e-3)) * 10)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, other): #other is a to_dict() from another game or worker
+        for bucket, count in other['buckets'].items():
+            self.buckets[int(bucket)] += count
+        self.count += other['count']
+        self.total += other['total']
+        self.max = max(self.max, other['max'])
+
+    def percentile(self, p): #upper edge of the bucket holding the p-th value
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= p * self.count:
+                return min(10 ** (bucket / 10), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'buckets': dict(self.buckets), 'count': self.count, 'total': self.total, 'max': self.max}
+
+    def report(self):
+        if not self.count:
+            return {'count': 0}
+        return {'count': self.count, 'mean': self.total / self.count, 'p50': self.percentile(0.5), 'p90': self.percentile(0.9),
+                'p99': self.percentile(0.99), 'max': self.max, 'histogram': {f"{10 ** (bucket / 10):.4g}": self.buckets[bucket] for bucket in sorted(self.buckets)}}
+
+class SearchInstrument: #where the search time goes: per move histograms plus expectimax node and branching counts, see set_instrument
+    HISTOGRAMS = ['move_ms', 'nodes', 'evaluations', 'rollouts']
 
-def expectimax_policy(state, depth=3):
+    def __init__(self):
+        self.histograms = {name: Histogram() for name in self.HISTOGRAMS} #one value per move
+        self.nodes_by_depth = defaultdict(int) #expectimax nodes by remaining depth
+        self.branching = defaultdict(int) #chance node branching factor (spawns expanded) -> chance nodes
+        #counters of the move in progress, bumped from inside the search
+        self.nodes = 0
+        self.evaluations = 0
+        self.rollouts = 0
+
+    def end_move(self, seconds):
+        self.histograms['move_ms'].add(seconds * 1000)
+        for name in ('nodes', 'evaluations', 'rollouts'): #only moves that did that kind of work count, greedy moves have no nodes
+            if getattr(self, name):
+                self.histograms[name].add(getattr(self, name))
+                setattr(self, name, 0)
+
+    def to_dict(self): #plain dicts so it pickles back from a worker
+        return {'histograms': {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+                'nodes_by_depth': dict(self.nodes_by_depth), 'branching': dict(self.branching)}
+
+    def merge(self, other):
+        for name, histogram in other['histograms'].items():
+            self.histograms[name].merge(histogram)
+        for depth, count in other['nodes_by_depth'].items():
+            self.nodes_by_depth[int(depth)] += count
+        for factor, count in other['branching'].items():
+            self.branching[int(factor)] += count
+
+    def report(self):
+        report = {name: histogram.report() for name, histogram in self.histograms.items()}
+        report['nodes_by_depth'] = dict(sorted(self.nodes_by_depth.items(), reverse=True))
+        report['branching'] = dict(sorted(self.branching.items()))
+        return report
+
+    def write(self, path): #csv if the path ends in .csv, json otherwise
+        report = self.report()
+        if not path.endswith('.csv'):
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2)
+            return
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['metric', 'key', 'value'])
+            for metric, values in report.items():
+                for key, value in values.items():
+                    if isinstance(value, dict): #histogram buckets
+                        for edge, count in value.items():
+                            writer.writerow([metric, f"{key}<={edge}", count])
+                    else:
+                        writer.writerow([metric, key, value])
+
+instrument = None #the SearchInstrument of the game running in this process, None keeps the search hooks to one check
+
+def set_instrument(new_instrument):
+    global instrument
+    instrument = new_instrument
+
+def check_depth(depth):
+    #the root plays a move and searches the spawn below it at depth - 1, node types come from the parity of the depth, so only odd depths alternate
+    if depth < 1 or depth % 2 == 0:
+        raise ValueError(f"Expectimax depth must be odd and at least 1, not {depth}")
+
+def expectimax_policy(state, depth=EXPECTIMAX_DEPTH, table=None, budget=None, pruning=None):
+    check_depth(depth)
     best_move = None
     best_value = float('-inf')
-    moves = state.possible_moves()
-
-    for move in moves:
-        new_state = copy.deepcopy(state)
-        new_state.next_state(move)
-        value = expectimax(new_state, depth - 1)
+    board = state.bitboard
+
+    children = successors_bits(board)
+    if pruning is not None and pruning.star >= 2:
+        children.sort(key=lambda child: -evaluate_board(child[1], state.score + child[2]))
+    for move, new_board, gained in children:
+        alpha = best_value if pruning is not None and pruning.star else float('-inf')
+        value = expectimax_value(new_board, state.score + gained, depth - 1, table, budget, pruning, 1.0, alpha) #the tile spawn is the chance node below
         if value > best_value:
             best_value = value
             best_move = move
 
     return best_move
 
-
-def expectimax(state, depth):
-    if not state.can_move() or depth == 0:
-        return evaluate_state(state)
-
-    #max_node: player's move
-    def max_value(state, depth):
-        moves = state.possible_moves()
-        
-        #recurse
-        max_val = float('-inf')
-        for move in moves:
-            new_state = copy.deepcopy(state)
-            new_state.next_move(move)
-            val = expectimax(new_state, depth - 1)
-            max_val = max(max_val, val)
-        return max_val
-
-    #chance node: random tile placement
-    def chance_value(state, depth):
-        empty_cells = [(r, c) for r in range(state.size) for c in range(state.size) if state.board[r][c] == 0]
-        if not empty_cells:
-            return evaluate_state(state)
-        
-        total_value = 0
-        for r, c in empty_cells:
-            new_state = copy.deepcopy(state)
-            new_state.board[r][c] = 2
-            total_value += expectimax(new_state, depth - 1)
-        
-        return total_value / len(empty_cells)  #average value over all possible placements
+def iterative_expectimax_policy(state, time_budget=None, node_budget=None, max_depth=MAX_ITERATIVE_DEPTH, table=None, pruning=None, root_pool=None):
+    #searches depths 1, 3, 5, ... until the budget runs out and plays the move of the deepest search that finished
+    budget = SearchBudget(time_budget, node_budget)
+    best_move = None
+    for depth in range(1, max_depth + 1, 2):
+        try:
+            if root_pool is not None: #workers only share the deadline, the node budget can't be split across them
+                best_move = root_pool.policy(state, depth, pruning, budget.deadline)
+            else:
+                best_move = expectimax_policy(state, depth, table, budget, pruning)
+        except SearchTimeout: #only complete iterations are trusted, the table only holds finished subtrees
+            break
+    if best_move is None: #budget too small for even depth 1, fall back to the one ply search without a budget
+        best_move = expectimax_policy(state, 1, table, None, pruning)
+    return best_move
 
 
-    if depth % 2 == 1:  #player move
-        return max_value(state, depth)
+worker_table = None #each root pool worker keeps its own transposition table warm between moves
+
+def search_subtree(board, score, depth, prob, options, deadline=None): #runs in a root pool worker, returns (value or None on timeout, pruning stats)
+    global worker_table
+    tt_size, tt_policy, prob_cutoff, max_spawns, cache = options
+    if tt_size and worker_table is None:
+        worker_table = TranspositionTable(tt_size, tt_policy, get_shared_cache(*cache, prob_cutoff, max_spawns) if cache else None)
+    pruning = Pruning(prob_cutoff, max_spawns) if prob_cutoff or max_spawns else None
+    budget = SearchBudget(deadline - time.time()) if deadline is not None else None
+    try:
+        value = expectimax_value(board, score, depth, worker_table, budget, pruning, prob)
+    except SearchTimeout:
+        value = None
+    return value, pruning.stats() if pruning else None
+
+worker_executors = {} #persistent process pools shared by the parallel search modes, keyed by worker count, evaluator and board size
+
+def get_executor(workers):
+    key = (workers, ntuple_path, board_size)
+    if key not in worker_executors:
+        initializer, initargs = worker_initializer()
+        worker_executors[key] = ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+    return worker_executors[key]
+
+class RootPool: #searches the expectimax root moves (and optionally the first spawn layer) in parallel on a persistent pool
+    def __init__(self, workers, split_chance=False, tt_size=200000, tt_policy='lru', cache=None):
+        self.executor = get_executor(workers)
+        self.split_chance = split_chance #one job per (move, spawn cell) instead of one per move, for when there are more cores than moves
+        self.tt_size = tt_size
+        self.tt_policy = tt_policy
+        self.cache = cache #(path, slots, policy) of a shared value cache or None
+
+    def policy(self, state, depth, pruning=None, deadline=None):
+        check_depth(depth)
+        #star pruning needs the alpha of moves searched before, which parallel jobs don't have, so only the other options reach the workers
+        options = (self.tt_size, self.tt_policy, pruning.prob_cutoff if pruning else 0.0, pruning.max_spawns if pruning else None, self.cache)
+        jobs = []
+        for move, new_board, gained in successors_bits(state.bitboard):
+            empty = empty_cells(new_board)
+            if self.split_chance and depth >= 2 and empty:
+                if pruning is not None and pruning.max_spawns and len(empty) > pruning.max_spawns: #same spread as chance_value
+                    pruning.skipped['spawns'][depth - 2] += len(empty) - pruning.max_spawns
+                    empty = [empty[i * len(empty) // pruning.max_spawns] for i in range(pruning.max_spawns)]
+                futures = [self.executor.submit(search_subtree, new_board | (1 << cell), state.score + gained, depth - 2, 1.0 / len(empty), options, deadline)
+                           for cell in empty]
+            else:
+                futures = [self.executor.submit(search_subtree, new_board, state.score + gained, depth - 1, 1.0, options, deadline)]
+            jobs.append((move, futures))
+
+        #merge in submission order so the result never depends on which worker finished first
+        best_move = None
+        best_value = float('-inf')
+        timed_out = False
+        for move, futures in jobs:
+            values = []
+            for future in futures:
+                value, skipped = future.result()
+                if value is None:
+                    timed_out = True
+                values.append(value)
+                if skipped and pruning is not None:
+                    for option, counts in skipped.items():
+                        for depth_left, count in counts['by_depth'].items():
+                            pruning.skipped[option][depth_left] += count
+            if timed_out:
+                continue
+            value = sum(values) / len(values)
+            if value > best_value:
+                best_value = value
+                best_move = move
+        if timed_out:
+            raise SearchTimeout()
+        return best_move
+
+root_pools = {} #pools live for the whole process, keyed by their settings
+
+def get_root_pool(workers, split_chance=False, tt_size=200000, tt_policy='lru', cache=None):
+    key = (workers, split_chance, tt_size, tt_policy, cache, board_size)
+    if key not in root_pools:
+        root_pools[key] = RootPool(workers, split_chance, tt_size, tt_policy, cache)
+    return root_pools[key]
+
+def shutdown_worker_pools():
+    for executor in worker_executors.values():
+        executor.shutdown()
+    worker_executors.clear()
+    root_pools.clear()
+
+
+def expectimax(state, depth, table=None, budget=None, pruning=None):
+    return expectimax_value(state.bitboard, state.score, depth, table, budget, pruning)
+
+def expectimax_value(board, score, depth, table=None, budget=None, pruning=None, prob=1.0, alpha=float('-inf')):
+    #prob is the chance of reaching this node, alpha the value it has to beat to matter to the max node above (star pruning)
+    if budget is not None:
+        budget.tick()
+    if instrument is not None:
+        instrument.nodes += 1
+        instrument.nodes_by_depth[depth] += 1
+    if depth == 0 or not can_move_bits(board):
+        return evaluate_board(board, score)
+    if pruning is not None and prob < pruning.prob_cutoff:
+        pruning.skipped['prob'][depth] += 1
+        return evaluate_board(board, score)
+
+    #every leaf below this node carries the current score, so the table stores values relative to it and the same board hits whatever the score
+    node_type = depth % 2
+    if table is not None:
+        cached = table.get(board, depth, node_type)
+        if cached is not None:
+            return score + cached
+
+    if node_type == 1:  #player move
+        value = max_value(board, score, depth, table, budget, pruning, prob, alpha)
     else:  #random tile placement
-        return chance_value(state, depth)
+        value = chance_value(board, score, depth, table, budget, pruning, prob, alpha)
+
+    if table is not None and alpha == float('-inf'): #with a finite alpha the value may only be a bound
+        table.store(board, depth, node_type, value - score)
+    return value
+
+#max_node: player's move
+def max_value(board, score, depth, table, budget=None, pruning=None, prob=1.0, alpha=float('-inf')):
+    max_val = float('-inf')
+    children = successors_bits(board)
+    star = pruning is not None and pruning.star
+    if star and pruning.star >= 2: #probe: search the best looking move first so later moves get a higher alpha
+        children.sort(key=lambda child: -evaluate_board(child[1], score + child[2]))
+    for _, new_board, gained in children:
+        val = expectimax_value(new_board, score + gained, depth - 1, table, budget, pruning, prob, max(alpha, max_val) if star else alpha)
+        if val > max_val:
+            max_val = val
+    return max_val
+
+#chance node: random tile placement
+def chance_value(board, score, depth, table, budget=None, pruning=None, prob=1.0, alpha=float('-inf')):
+    empty = empty_cells(board)
+    if not empty:
+        return evaluate_board(board, score)
+
+    if pruning is not None and pruning.max_spawns and len(empty) > pruning.max_spawns: #spread the expanded cells over the board
+        pruning.skipped['spawns'][depth - 1] += len(empty) - pruning.max_spawns
+        empty = [empty[i * len(empty) // pruning.max_spawns] for i in range(pruning.max_spawns)]
+    n = len(empty)
+    if instrument is not None:
+        instrument.branching[n] += 1
+    star = pruning is not None and pruning.star and alpha != float('-inf')
+    if star:
+        _, upper = evaluator.bounds(board | (1 << empty[0]), score, depth - 1) #same tile sum whichever cell gets the 2
+    
+    total_value = 0
+    for i, cell in enumerate(empty):
+        child_alpha = float('-inf')
+        if star:
+            remaining = n - i
+            best_case = (total_value + remaining * upper) / n
+            if best_case <= alpha: #Star1: even if every remaining spawn hit the upper bound this node can't beat alpha
+                pruning.skipped['star'][depth - 1] += remaining
+                return best_case
+            child_alpha = n * alpha - total_value - (remaining - 1) * upper #what this child has to beat for the node to beat alpha
+        total_value += expectimax_value(board | (1 << cell), score, depth - 1, table, budget, pruning, prob / n, child_alpha) #place a 2
+    
+    return total_value / n  #average value over all possible placements
 
 
 
@@ -81,9 +850,12 @@ def expectimax(state, depth):
 ##################################################################################################################################################################################
 ##################################################################################################################################################################################
 
-class Node:
-    def __init__(self, state, parent=None, action=None, is_chance_node=False):
-        self.state = state  #2048 game instance
+class Node: #slots keep a node small, it holds the packed board and score instead of a whole Game2048
+    __slots__ = ('board', 'score', 'parent', 'children', 'n', 'r', 'action', 'is_chance_node')
+
+    def __init__(self, board, score, parent=None, action=None, is_chance_node=False):
+        self.board = board
+        self.score = score
         self.parent = parent
         self.children = []
         self.n = 0 
@@ -95,108 +867,371 @@ def UCB(r, n, T):
     exploration = math.sqrt(2 * math.log(T) / n)
     return (r / n) + exploration
 
-def traverse(node):
+#rng is anything with random's interface, the module itself by default or a seeded random.Random for reproducible games
+def traverse(node, rng=random):
     while node.children:
         if node.is_chance_node: #randomly choose chance node so we don't run into the issue of traversing a chance node to much. We want uniform visits for chance nodes. As n->inf random->uniform visits for each node
-            node = random.choice(node.children)
+            node = rng.choice(node.children)
         else: #pick move with best ucb value
             unvisited_children = []
             for child in node.children:
                 if child.n == 0:
                     unvisited_children.append(child)
             if unvisited_children:
-                return random.choice(unvisited_children)
+                return rng.choice(unvisited_children)
             
             T = node.n
             node = max(node.children, key=lambda child: UCB(child.r, child.n, T))
     return node
 
-def expand(node):
+def expand(node, rng=random):
     if node.is_chance_node: #expand chance nodes by adding tile '2' in random empty cells
-        empty_cells = [(r, c) for r in range(node.state.size) for c in range(node.state.size) if node.state.board[r][c] == 0]
-        for r, c in empty_cells:
-            new_state = copy.deepcopy(node.state)
-            new_state.board[r][c] = 2
-            child = Node(new_state, parent=node, is_chance_node=False)
+        for cell in empty_cells(node.board):
+            child = Node(node.board | (1 << cell), node.score, parent=node, is_chance_node=False) #place a 2
             node.children.append(child)
     else: #expand decision nodes by adding valid moves
-        for move in node.state.possible_moves():
-            new_state = copy.deepcopy(node.state)
-            new_state.next_move(move)
-            child = Node(new_state, parent=node, action=move, is_chance_node=True)
+        for move, board, gained in successors_bits(node.board):
+            child = Node(board, node.score + gained, parent=node, action=move, is_chance_node=True)
             node.children.append(child)
-    return random.choice(node.children)
-
-def simulate(node):
-    state = node.state
-    if node.is_chance_node: #modify board a bit to ensure random playout doens't start on chance nodes
-        node.state.add_random_tile()
-
-    for _ in range(25): #prune since 2048 can take too long to end
-        if not state.can_move():
+    return rng.choice(node.children)
+
+def simulate(node, rng=random): #one heuristic playout, the node is left untouched
+    mean, _ = DEFAULT_PLAYOUT.run(node, 1, rng)
+    return mean
+
+#playout policies, each plays up to depth moves on bare (board, score) values in a tight loop and returns the final (board, score)
+PLAYOUT_ORDER = [SLIDES[0], SLIDES[3], SLIDES[1], SLIDES[2]] #up, right, left, down: keeps the big tiles in the top right corner like the snake weights
+
+def heuristic_playout(board, score, depth, rng):
+    for _ in range(depth):
+        #choose the move that maximizes the heuristic evaluation, can't be entirely random playout as we still want good moves
+        best_value = None
+        for _, new_board, gained in successors_bits(board):
+            value = evaluate_board(new_board, score + gained)
+            if best_value is None or value > best_value:
+                best_value = value
+                best_board = new_board
+                best_score = score + gained
+        if best_value is None: #no legal move, game over
             break
-        #choose the move that maximizes the heuristic evaluation
-        moves = state.possible_moves()
-        best_move = max( #can't be entirely random playout as we still want good moves
-            moves,
-            key=lambda move: evaluate_state(copy.deepcopy(state).next_state(move))
-        )
-        state.next_state(best_move) 
-
-    return evaluate_state(state) / (2 ** 20) #makes reward smaller helps with exploration
-
-def update(node, reward):
+        board = best_board
+        score = best_score
+        empty = empty_cells(board)
+        if empty:
+            board |= 1 << rng.choice(empty)
+    return board, score
+
+def greedy_playout(board, score, depth, rng): #biggest merge, ties go to the corner order, a few table lookups per move
+    for _ in range(depth):
+        best_board = board
+        best_gain = -1
+        for slide in PLAYOUT_ORDER:
+            new_board, gained = slide(board)
+            if new_board != board and gained > best_gain:
+                best_board = new_board
+                best_gain = gained
+        if best_gain < 0:
+            break
+        board = best_board
+        score += best_gain
+        empty = empty_cells(board)
+        board |= 1 << rng.choice(empty) #a legal move always frees a cell
+    return board, score
+
+def corner_playout(board, score, depth, rng): #first legal move in the corner order
+    for _ in range(depth):
+        for slide in PLAYOUT_ORDER:
+            new_board, gained = slide(board)
+            if new_board != board:
+                break
+        else:
+            break
+        board = new_board
+        score += gained
+        board |= 1 << rng.choice(empty_cells(board))
+    return board, score
+
+def random_playout(board, score, depth, rng):
+    for _ in range(depth):
+        children = successors_bits(board)
+        if not children:
+            break
+        _, board, gained = rng.choice(children)
+        score += gained
+        board |= 1 << rng.choice(empty_cells(board))
+    return board, score
+
+PLAYOUTS = {'heuristic': heuristic_playout, 'greedy': greedy_playout, 'corner': corner_playout, 'random': random_playout}
+
+class Playout: #mcts rollout policy and depth, counts the rollouts it ran so a run can report rollouts/sec
+    def __init__(self, policy='heuristic', depth=25):
+        if policy not in PLAYOUTS:
+            raise ValueError(f"Unknown playout policy: {policy}")
+        self.policy = policy
+        self.depth = depth #prune since 2048 can take too long to end
+        self.play = PLAYOUTS[policy]
+        self.rollouts = 0
+        self.seconds = 0.0
+
+    def run(self, node, count=1, rng=random): #count playouts from node in one tight loop, returns the (mean, variance) of their rewards
+        start = time.perf_counter()
+        play = self.play
+        depth = self.depth
+        total = 0.0
+        squares = 0.0
+        for _ in range(count):
+            board = node.board
+            if node.is_chance_node: #modify board a bit to ensure random playout doens't start on chance nodes
+                empty = empty_cells(board)
+                if empty:
+                    board |= 1 << rng.choice(empty)
+            board, score = play(board, node.score, depth, rng)
+            reward = evaluate_board(board, score) / (2 ** 20) #makes reward smaller helps with exploration
+            total += reward
+            squares += reward * reward
+        self.rollouts += count
+        self.seconds += time.perf_counter() - start
+        mean = total / count
+        return mean, max(squares / count - mean * mean, 0.0)
+
+    def stats(self):
+        return {'rollouts': self.rollouts, 'seconds': self.seconds}
+
+DEFAULT_PLAYOUT = Playout()
+
+def update(node, reward, visits=1): #reward is the sum over all visits
     while node:
-        node.n += 1
+        node.n += visits
         node.r += reward
         node = node.parent
 
-def mcts_policy(root_state, time_limit):
-    root = Node(root_state, is_chance_node=False)
+def subtree_size(node):
+    size = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        size += 1
+        stack.extend(node.children)
+    return size
+
+class MCTSTree: #search tree that survives between moves of one game, capped at max_nodes
+    def __init__(self, max_nodes=200000):
+        self.max_nodes = max_nodes
+        self.root = None
+        self.size = 0
+        self.reused = 0 #nodes carried over from earlier moves
+
+    def set_root(self, board, score):
+        #after the real move and spawn the new position is a grandchild of the old root (decision -> chance -> decision), keep that subtree
+        if self.root is not None:
+            for chance_node in self.root.children:
+                for child in chance_node.children:
+                    if child.board == board and child.score == score:
+                        child.parent = None
+                        self.root = child
+                        self.size = subtree_size(child)
+                        self.reused += self.size
+                        return
+        self.root = Node(board, score, is_chance_node=False)
+        self.size = 1
+
+    def can_expand(self, node): #expanding adds one child per move or empty cell, the root is always expanded so there is a move to pick
+        return node is self.root or self.size + board_size * board_size <= self.max_nodes
+
+def mcts_search(root_state, time_limit=None, rollouts=1, tree=None, iterations=None, rng=random, playout=None): #grows the tree and returns its root
+    #stops after time_limit seconds or the given number of iterations, whichever comes first, iterations alone make a search reproducible
+    if time_limit is None and iterations is None:
+        raise ValueError("mcts needs a time limit or an iteration budget")
+    tree = tree or MCTSTree()
+    playout = playout or DEFAULT_PLAYOUT
+    tree.set_root(root_state.bitboard, root_state.score)
+    root = tree.root
     start_time = time.time()
+    iteration = 0
 
-    while time.time() - start_time < time_limit:
+    while (iterations is None or iteration < iterations) and (time_limit is None or time.time() - start_time < time_limit):
+        iteration += 1
         #traverse
-        leaf = traverse(root)        
-        #expand
-        if not leaf.children and leaf.state.can_move():
-            leaf = expand(leaf)
+        leaf = traverse(root, rng)        
+        #expand, once the tree is full we only keep refining the statistics of the nodes we have
+        if not leaf.children and can_move_bits(leaf.board) and tree.can_expand(leaf):
+            leaf = expand(leaf, rng)
+            tree.size += len(leaf.parent.children)
         
-        #simulate
-        sim_leaf = copy.deepcopy(leaf)
-        reward = simulate(sim_leaf)
+        #simulate, leaf parallelism: several playouts from the same leaf share one traversal
+        mean, _ = playout.run(leaf, rollouts, rng)
         
         #update
-        update(leaf, reward)
+        update(leaf, mean * rollouts, rollouts)
+    if instrument is not None:
+        instrument.rollouts += iteration * rollouts
+    return root
+
+def mcts_policy(root_state, time_limit=None, rollouts=1, tree=None, iterations=None, rng=random, playout=None):
+    root = mcts_search(root_state, time_limit, rollouts, tree, iterations, rng, playout)
     # for c in root.children:
     #     print(c.n)
     # print('------------')
-    best_child = max(root.children, key=lambda c: c.r / c.n)
+    if not root.children: #budget too small for a single iteration, fall back to the one step heuristic like the root parallel path
+        return max(successors_bits(root.board), key=lambda child: evaluate_board(child[1], root.score + child[2]))[0]
+    #expand visits the child it returns, so an expanded root always has a visited child
+    visited = [c for c in root.children if c.n > 0]
+    best_child = max(visited, key=lambda c: c.r / c.n) #unvisited children have no mean to compare
     return best_child.action
 
+def mcts_root_stats(root_state, time_limit=None, rollouts=1, iterations=None, seed=None, playout=None): #runs in a worker, one independent tree per call
+    root = mcts_search(root_state, time_limit, rollouts, None, iterations, random.Random(seed), playout)
+    return [(child.action, child.n, child.r) for child in root.children]
+
+MCTS_MERGES = ['sum', 'visits', 'vote']
+
+def merge_root_stats(trees, merge='sum'):
+    #sum: pool n and r of every tree and take the best mean, visits: most pooled visits, vote: each tree votes for its best mean
+    totals = {}
+    votes = defaultdict(int)
+    for stats in trees:
+        visited = [(action, n, r) for action, n, r in stats if n > 0]
+        for action, n, r in visited:
+            total_n, total_r = totals.get(action, (0, 0))
+            totals[action] = (total_n + n, total_r + r)
+        if visited:
+            votes[max(visited, key=lambda child: child[2] / child[1])[0]] += 1
+    moves = [move for move in MOVES if move in totals] #fixed order so ties don't depend on which worker finished first
+    if not moves: #no tree visited anything
+        return None
+    if merge == 'visits':
+        return max(moves, key=lambda move: totals[move][0])
+    if merge == 'vote':
+        return max(moves, key=lambda move: (votes[move], totals[move][0]))
+    return max(moves, key=lambda move: totals[move][1] / totals[move][0])
+
+def root_parallel_mcts_policy(root_state, time_limit, workers, merge='sum', rollouts=1, iterations=None, rng=random, playout=None):
+    #root parallelism: independent trees on a persistent pool, merged at the root, each tree gets its own seed drawn from rng
+    executor = get_executor(workers)
+    futures = [executor.submit(mcts_root_stats, root_state, time_limit, rollouts, iterations, rng.getrandbits(64), playout) for _ in range(workers)]
+    trees = [future.result() for future in futures]
+    if instrument is not None: #playouts that reached a root child, the workers' own counters stay in the workers
+        instrument.rollouts += sum(n for stats in trees for _, n, _ in stats)
+    return merge_root_stats(trees, merge)
+
 
 ##################################################################################################################################################################################
 ##################################################################################################################################################################################
 ##################################################################################################################################################################################
 
+class SearchSettings: #knobs for the search agents, passed from main() down to determine_move
+    def __init__(self, depth=EXPECTIMAX_DEPTH, move_time=None, move_nodes=None, adaptive_depth=False, tt_size=200000, tt_policy='lru',
+                 prob_cutoff=0.0, max_spawns=None, star=0, root_workers=0, split_chance=False,
+                 mcts_time=0.5, mcts_workers=0, mcts_merge='sum', mcts_rollouts=1, mcts_nodes=200000, mcts_reuse=True, mcts_iterations=None,
+                 instrument=False, cache=None, cache_slots=1 << 20, cache_policy='depth', mcts_playout='heuristic', mcts_playout_depth=25):
+        self.depth = depth
+        self.move_time = move_time #seconds per expectimax move, switches to iterative deepening
+        self.move_nodes = move_nodes #nodes per expectimax move, switches to iterative deepening
+        self.adaptive_depth = adaptive_depth #pick the depth from the number of empty cells
+        self.tt_size = tt_size
+        self.tt_policy = tt_policy
+        self.prob_cutoff = prob_cutoff #see Pruning
+        self.max_spawns = max_spawns
+        self.star = star
+        self.root_workers = root_workers #search the root moves of every expectimax move on a persistent pool of this many workers
+        self.split_chance = split_chance #also split the first spawn layer across the pool
+        self.mcts_time = mcts_time #seconds per mcts move
+        self.mcts_workers = mcts_workers #independent trees per move on a persistent pool, 0 searches in process
+        self.mcts_merge = mcts_merge #how the trees are merged, see merge_root_stats
+        self.mcts_rollouts = mcts_rollouts #playouts per expanded leaf
+        self.mcts_nodes = mcts_nodes #memory cap of the mcts tree
+        self.mcts_reuse = mcts_reuse #keep the subtree of the position actually reached as the next move's root
+        self.mcts_iterations = mcts_iterations #iterations per mcts move, replaces mcts_time so results don't depend on machine load
+        self.instrument = instrument #collect a SearchInstrument for every game
+        self.cache = cache #path of a persistent value cache behind every transposition table, see cache2048.py
+        self.cache_slots = cache_slots #size of a new cache file
+        self.cache_policy = cache_policy
+        self.mcts_playout = mcts_playout #rollout policy, see PLAYOUTS
+        self.mcts_playout_depth = mcts_playout_depth #moves per rollout
+
+    def mcts_move(self, state, tree=None, playout=None):
+        time_limit = self.mcts_time if self.mcts_iterations is None else None
+        if self.mcts_workers:
+            move = root_parallel_mcts_policy(state, time_limit, self.mcts_workers, self.mcts_merge, self.mcts_rollouts, self.mcts_iterations, state.rng, playout)
+            if move is not None:
+                return move
+            return max(state.successors(), key=lambda child: evaluate_board(child[1], state.score + child[2]))[0] #nothing visited, one step heuristic
+        return mcts_policy(state, time_limit, self.mcts_rollouts, tree or MCTSTree(self.mcts_nodes), self.mcts_iterations, state.rng, playout)
+
+    def shared_cache(self):
+        if not self.cache:
+            return None
+        return get_shared_cache(self.cache, self.cache_slots, self.cache_policy, self.prob_cutoff, self.max_spawns)
+
+    def make_playout(self): #one per game so the rollout counts cover the whole game
+        return Playout(self.mcts_playout, self.mcts_playout_depth)
+
+    def make_pruning(self): #one per game so the skip counts cover the whole game
+        if self.prob_cutoff or self.max_spawns or self.star:
+            return Pruning(self.prob_cutoff, self.max_spawns, self.star)
+        return None
+
+    def expectimax_move(self, state, table=None, time_left=float('inf'), pruning=None):
+        depth = adaptive_depth(state.bitboard) if self.adaptive_depth else self.depth
+        cache = (self.cache, self.cache_slots, self.cache_policy) if self.cache else None
+        root_pool = get_root_pool(self.root_workers, self.split_chance, self.tt_size, self.tt_policy, cache) if self.root_workers else None
+        if self.move_time is None and self.move_nodes is None:
+            if time_left == float('inf'):
+                if root_pool is not None:
+                    return root_pool.policy(state, depth, pruning)
+                return expectimax_policy(state, depth, table, None, pruning)
+            return iterative_expectimax_policy(state, time_left, None, depth, table, pruning, root_pool) #fixed depth that still stops at the game's deadline
+        #the game's remaining time caps the move budget so the time limit is respected
+        time_budget = min(self.move_time if self.move_time is not None else float('inf'), time_left)
+        max_depth = depth if self.adaptive_depth else MAX_ITERATIVE_DEPTH
+        if root_pool is not None and time_budget == float('inf'): #the node budget doesn't reach the workers, without a deadline nothing would stop the deepening
+            max_depth = depth
+        return iterative_expectimax_policy(state, time_budget if time_budget != float('inf') else None, self.move_nodes, max_depth, table, pruning, root_pool)
+
+class GameSearch: #search state that lives for one game: transposition table, pruning counters and the mcts tree
+    def __init__(self, strategy, settings):
+        self.table = TranspositionTable(settings.tt_size, settings.tt_policy, settings.shared_cache()) if strategy == 5 and settings.tt_size > 0 else None
+        self.pruning = settings.make_pruning() if strategy == 5 else None
+        self.tree = MCTSTree(settings.mcts_nodes) if strategy == 4 and settings.mcts_reuse and not settings.mcts_workers else None
+        self.instrument = SearchInstrument() if settings.instrument else None
+        self.playout = settings.make_playout() if strategy == 4 else None
+
+    def stats(self):
+        stats = {}
+        if self.table:
+            stats['tt'] = self.table.stats()
+        if self.pruning:
+            stats['pruning'] = self.pruning.stats()
+        if self.playout:
+            stats['mcts'] = self.playout.stats() #rollouts run in root parallel workers are counted there, not here
+            stats['mcts']['reused_nodes'] = self.tree.reused if self.tree else 0
+        if self.instrument:
+            stats['instrument'] = self.instrument.to_dict()
+        return stats or None
+
 class Game2048:
-    def __init__(self):
-        self.size = 4
+    def __init__(self, seed=None, size=None):
+        self.rng = random.Random(seed) #every random choice of the game and its agents goes through this, so a seed replays the whole game
+        if size is not None and size != board_size: #every game of a process shares its engine, switching it here would break the games already running
+            raise ValueError(f"This process plays {board_size}x{board_size} boards, call set_board_size({size}) before making any game")
+        self.size = board_size
         self.score = 0
-        self.board = [[0] * self.size for _ in range(self.size)]
+        self.bitboard = 0 #packed board, see bitboard engine above
         self.highest = 2
+        self.moves = 0 #moves played so far
         self.add_random_tile()
         self.add_random_tile()
+
+    @property
+    def board(self): #list of lists view of the tile values, only used for printing and interactive play
+        return bits_to_board(self.bitboard)
+
+    @board.setter
+    def board(self, board):
+        self.bitboard = board_to_bits(board)
     
     def next_state(self, move): #performs move and adds new tile
-        if move == 'w':
-            self.slide_up()
-        elif move == 'a':
-            self.slide_left()
-        elif move == 's':
-            self.slide_down()
-        else:
-            self.slide_right()
+        self.next_move(move)
         self.add_random_tile()
         return self
     
@@ -212,95 +1247,76 @@ class Game2048:
         return self
     
 
-    def possible_moves(self):
-        moves = []
-        for direction, slide_func in [('w', self.slide_up), ('a', self.slide_left), ('s', self.slide_down), ('d', self.slide_right)]:
-            #store the original board state
-            original_board = [row[:] for row in self.board]
-
-            slide_func()
-
-            if self.board != original_board:
-                moves.append(direction)
-
-            #restore the original board
-            self.board = original_board
+    def successors(self): #(move, board, score gained, highest tile) for every legal move
+        result = []
+        for move, board, gained in successors_bits(self.bitboard):
+            highest = self.highest
+            if gained: #highest tile can only change on a merge
+                highest = max(highest, 1 << max_exponent(board))
+            result.append((move, board, gained, highest))
+        return result
 
-        return moves
+    def possible_moves(self):
+        return [move for move, _, _ in successors_bits(self.bitboard)]
     
-    def greedy_moves(self): #goes for highest high score (short term)
+    def greedy_moves(self, successors=None): #goes for highest high score (short term)
+        if successors is None:
+            successors = self.successors()
         highest_score = -1
         moves = []
-        for direction, slide_func in [(0, self.slide_up), (1, self.slide_left), (2, self.slide_down), (3, self.slide_right)]:
-            #store the original board state
-            original_board = [row[:] for row in self.board]
-
-            slide_func()
+        for move, _, gained, _ in successors:
+            moves.append((MOVES.index(move), gained))
+            if gained > highest_score:
+                highest_score = gained
 
-            #if the board changes, the move is valid
-            if self.board != original_board:
-                moves.append((direction, self.score))
-                if self.score > highest_score:
-                    highest_score = self.score
-
-            #restore the original board
-            self.board = original_board
         if highest_score < 0:
-            return random.randint(0, 3)
+            return self.rng.randint(0, 3)
         highest_moves = []
         for direction, score in moves:
             if score >= highest_score:
                 highest_moves.append(direction)
-        return highest_moves[random.randint(0, len(highest_moves) - 1)]
-    
-    def add_random_tile(self):
-        empty_tiles = [(r, c) for r in range(self.size) for c in range(self.size) if self.board[r][c] == 0]
+        return highest_moves[self.rng.randint(0, len(highest_moves) - 1)]
+
+    def empty_cells(self): #bit shifts of the empty cells
+        return empty_cells(self.bitboard)
+
+    def add_random_tile(self): #returns the shift of the new tile, None if the board is full
+        empty_tiles = empty_cells(self.bitboard)
         if not empty_tiles:
-            return
-        r, c = random.choice(empty_tiles)
-        self.board[r][c] = 2 #only add 2
+            return None
+        shift = self.rng.choice(empty_tiles)
+        self.bitboard |= 1 << shift #only add 2
+        return shift
 
     def can_move(self):
-        for r in range(self.size):
-            for c in range(self.size):
-                if self.board[r][c] == 0:
-                    return True
-                if c + 1 < self.size and self.board[r][c] == self.board[r][c + 1]:
-                    return True
-                if r + 1 < self.size and self.board[r][c] == self.board[r + 1][c]:
-                    return True
-        return False
-
-    def slide_row_left(self, row):
-        new_row = [num for num in row if num != 0]
-        merged = [False] * len(new_row)
-        
-        for i in range(len(new_row) - 1):
-            if new_row[i] == new_row[i + 1] and not merged[i] and not merged[i + 1]:
-                new_row[i] *= 2
-                self.score += new_row[i]
-                self.highest = new_row[i] if new_row[i] > self.highest else self.highest
-                new_row[i + 1] = 0
-                merged[i] = True
-        
-        new_row = [num for num in new_row if num != 0]
-        return new_row + [0] * (self.size - len(new_row))
+        return can_move_bits(self.bitboard)
+
+    def slide_row_left(self, row): #slides a single row of tile values, kept for callers that work with value rows
+        new_row, gained = slide_row_exponents([num.bit_length() - 1 if num else 0 for num in row])
+        if gained:
+            self.score += gained
+            self.highest = max(self.highest, 1 << max(new_row))
+        return [(1 << e) if e else 0 for e in new_row]
+
+    def slide(self, slide_bits):
+        self.bitboard, gained = slide_bits(self.bitboard)
+        if gained: #highest tile can only change on a merge
+            self.score += gained
+            highest = 1 << max_exponent(self.bitboard)
+            if highest > self.highest:
+                self.highest = highest
 
     def slide_left(self):
-        self.board = [self.slide_row_left(row) for row in self.board]
+        self.slide(slide_bits_left)
 
     def slide_right(self):
-        self.board = [self.slide_row_left(row[::-1])[::-1] for row in self.board]
+        self.slide(slide_bits_right)
 
     def slide_up(self):
-        self.board = list(map(list, zip(*self.board)))
-        self.slide_left()
-        self.board = list(map(list, zip(*self.board)))
+        self.slide(slide_bits_up)
 
     def slide_down(self):
-        self.board = list(map(list, zip(*self.board)))
-        self.slide_right()
-        self.board = list(map(list, zip(*self.board)))
+        self.slide(slide_bits_down)
 
     def print_board(self):
         for row in self.board:
@@ -317,17 +1333,10 @@ class Game2048:
                 print("Invalid move. Use 'w', 'a', 's', or 'd'.")
                 continue
 
-            old_board = [row[:] for row in self.board]
-            if move == 'w':
-                self.slide_up()
-            elif move == 'a':
-                self.slide_left()
-            elif move == 's':
-                self.slide_down()
-            elif move == 'd':
-                self.slide_right()
-
-            if self.board != old_board:
+            old_board = self.bitboard
+            self.next_move(move)
+
+            if self.bitboard != old_board:
                 self.add_random_tile()
             else:
                 print("Move didn't change the board. Try a different move.")
@@ -336,22 +1345,29 @@ class Game2048:
         print(f"Score: {self.score}")
         print("Game Over! Thanks for playing.")
 
-    def determine_move(self, strat, move_index):
+    def determine_move(self, strat, move_index, settings=None, search=None, successors=None, time_left=float('inf')): #successors can be passed in if the caller already has them
+        if settings is None:
+            settings = SearchSettings()
+        if search is None:
+            search = GameSearch(strat, settings)
+        if successors is None and strat in (2, 3):
+            successors = self.successors()
         # if strat == 1:
         #     return (move_index + 1) % 4
         if strat == 1:
-            return random.randint(0, 3)
+            return self.rng.randint(0, 3)
         if strat == 2:
-            r_move = self.can_move_right()
-            d_move = self.can_move_down()
+            legal = [move for move, _, _, _ in successors]
+            r_move = 'd' in legal
+            d_move = 's' in legal
             if r_move and d_move:
-                return random.randint(2, 3)
+                return self.rng.randint(2, 3)
             elif r_move:
                 return 3
             elif d_move:
                 return 2
             else:
-                return random.choice([0, 1])  #random between up and left
+                return self.rng.choice([0, 1])  #random between up and left
         # if strat == 4:
         #     r_move = self.can_move_right()
         #     d_move = self.can_move_down()
@@ -370,66 +1386,176 @@ class Game2048:
         #     return random.choice([0, 1])
         
         if strat == 3: #greedy
-            return self.greedy_moves()
+            return self.greedy_moves(successors)
         
         if strat == 4: #mcts
             # self.print_board()
             moves = ['w', 'a', 's', 'd']
-            move = mcts_policy(self, .5)
+            move = settings.mcts_move(self, search.tree, search.playout)
             return moves.index(move)
         
         if strat == 5: #expectimax
             # self.print_board()
             moves = ['w', 'a', 's', 'd']
-            move = expectimax_policy(self, 3)  #adjust depth for performance 3 or 5 is best
+            move = settings.expectimax_move(self, search.table, time_left, search.pruning)  #adjust depth for performance 3 or 5 is best
             return moves.index(move)
 
     def can_move_right(self):
-        old_board = [row[:] for row in self.board]
-        self.slide_right()
-        can_move = (self.board != old_board)
-        self.board = old_board  #restore board
-        return can_move
+        return slide_bits_right(self.bitboard)[0] != self.bitboard
 
     def can_move_down(self):
-        old_board = [row[:] for row in self.board]
-        self.slide_down()
-        can_move = (self.board != old_board)
-        self.board = old_board  #restore board
-        return can_move
+        return slide_bits_down(self.bitboard)[0] != self.bitboard
 
-    def simulate_game(self, strat, limit):
+    def simulate_game(self, strat, limit, settings=None, search=None, max_moves=None, recorder=None): #search is reused across every move of the game
+        #recorder gets every move played and where its tile spawned, see trajectory2048.TrajectoryWriter
+        #max_moves is a budget that doesn't depend on machine load, unlike limit (seconds)
         moves = ['w', 'a', 's', 'd']  #repeated move sequence
         move_index = -1
+        turns = 0
+        game_instrument = search.instrument if search is not None else None
+        set_instrument(game_instrument)
 
         start_time = time.time()
-        while self.can_move() and ((time.time() - start_time) < limit):
+        while (time.time() - start_time) < limit and (max_moves is None or turns < max_moves):
+            turns += 1
+            successors = self.successors() #no legal move means the game is over
+            if not successors:
+                break
             # self.print_board()
-            move_index = self.determine_move(strat, move_index)
+            move_start = time.perf_counter()
+            move_index = self.determine_move(strat, move_index, settings, search, successors, limit - (time.time() - start_time))
+            if game_instrument is not None:
+                game_instrument.end_move(time.perf_counter() - move_start)
             # print(f"move_index: {move_index}")
             move = moves[move_index]
 
-            old_board = [row[:] for row in self.board]
-            if move == 'w':
-                self.slide_up()
-            elif move == 'a':
-                self.slide_left()
-            elif move == 's':
-                self.slide_down()
-            elif move == 'd':
-                self.slide_right()
-
-            if self.board != old_board:
-                self.add_random_tile()
-
+            for legal_move, board, gained, highest in successors: #a move that doesn't change the board doesn't add a tile
+                if legal_move == move:
+                    self.bitboard = board
+                    self.score += gained
+                    self.highest = highest
+                    self.moves += 1
+                    shift = self.add_random_tile()
+                    if recorder is not None:
+                        recorder.move(move_index, shift)
+                    break
+
+        set_instrument(None)
         return self.score, self.highest
 
-def simulate_single_game(game_number, strategy, time_limit):
-    game = Game2048()
-    game.simulate_game(strat=strategy, limit=time_limit)
+def game_seed(seed, game_number): #independent seed per game so runs with nearby seeds don't share games
+    if seed is None:
+        return None
+    return random.Random(f"{seed}:{game_number}").getrandbits(64)
+
+trajectory_writer = None #each process appends the games it plays to its own trajectory file
+
+def get_trajectory_writer(directory):
+    global trajectory_writer
+    if trajectory_writer is None or trajectory_writer.directory != directory:
+        from trajectory2048 import TrajectoryWriter
+        trajectory_writer = TrajectoryWriter(directory)
+    return trajectory_writer
+
+def simulate_single_game(game_number, strategy, time_limit, settings=None, seed=None, max_moves=None, trajectories=None, size=None):
+    settings = settings or SearchSettings()
+    if seed is None: #recorded in the result so even an unseeded game can be replayed
+        seed = random.getrandbits(64)
+    game = Game2048(seed, size)
+    search = GameSearch(strategy, settings)
+    recorder = get_trajectory_writer(trajectories) if trajectories else None
+    if recorder is not None:
+        recorder.start(game_number, strategy, seed, game.bitboard)
+    start_time = time.time()
+    game.simulate_game(strat=strategy, limit=time_limit, settings=settings, search=search, max_moves=max_moves, recorder=recorder)
+    if recorder is not None:
+        recorder.end()
     
-    #return the relevant data for aggregation
-    return (game.score, game.highest)
+    #return the relevant data for aggregation, everything but stats goes into the results file
+    return {'game': game_number, 'seed': seed, 'strategy': strategy, 'size': game.size, 'score': game.score, 'highest': game.highest, 'moves': game.moves,
+            'duration': time.time() - start_time, 'stats': search.stats()}
+
+def read_results(path): #records of a results file by game number, a line cut off by a crash is skipped
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record['game']] = record
+    return records
+
+def open_results(path): #append only, starts on a fresh line if the last write was cut off
+    cut_off = False
+    if os.path.exists(path) and os.path.getsize(path):
+        with open(path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            cut_off = f.read(1) != b'\n'
+    results = open(path, 'a')
+    if cut_off:
+        results.write('\n')
+    return results
+
+def write_result(results, record): #flushed per game so a crash or ctrl-c only loses the games in flight
+    results.write(json.dumps({key: value for key, value in record.items() if key != 'stats'}) + '\n')
+    results.flush()
+
+def run_settings(args): #stable name of every option that changes how the games play, stored in each --results record so --resume can't mix runs
+    options = {'strategy': args.strategy, 'size': args.size, 'seed': args.seed, 'max_moves': args.max_moves, 'limit': args.limit}
+    if args.strategy == 5:
+        options.update(depth=args.depth, move_time=args.move_time, move_nodes=args.move_nodes, adaptive_depth=args.adaptive_depth,
+                       prob_cutoff=args.prob_cutoff, max_spawns=args.max_spawns, star=args.star, ntuple=args.ntuple)
+    elif args.strategy == 4:
+        options.update(mcts_time=args.mcts_time, mcts_iterations=args.mcts_iterations, mcts_workers=args.mcts_workers, mcts_merge=args.mcts_merge,
+                       mcts_rollouts=args.mcts_rollouts, mcts_nodes=args.mcts_nodes, mcts_reuse=not args.no_mcts_reuse,
+                       mcts_playout=args.mcts_playout, mcts_playout_depth=args.mcts_playout_depth, ntuple=args.ntuple)
+    return ",".join(f"{key}={value}" for key, value in sorted(options.items()))
+
+def run_games(args, time_limit, finished=()): #yields the result record of every game not in finished as it finishes
+    settings = SearchSettings(args.depth, args.move_time, args.move_nodes, args.adaptive_depth, args.tt_size, args.tt_policy,
+                              args.prob_cutoff, args.max_spawns, args.star, args.root_workers, args.split_chance,
+                              args.mcts_time, args.mcts_workers, args.mcts_merge, args.mcts_rollouts, args.mcts_nodes, not args.no_mcts_reuse,
+                              args.mcts_iterations, args.instrument is not None, args.cache, args.cache_slots, args.cache_policy,
+                              args.mcts_playout, args.mcts_playout_depth)
+    if args.cache and args.strategy == 5: #create the file before any worker maps it, and start a new generation for age eviction
+        settings.shared_cache().next_generation()
+    if args.batched: #all games in lockstep as one numpy array, numpy is only needed for this mode
+        from batch2048 import simulate_batch
+        for game_number, (score, highest, moves) in enumerate(simulate_batch(args.games, args.strategy, time_limit, args.seed, args.max_moves), 1):
+            yield {'game': game_number, 'seed': None, 'strategy': args.strategy, 'size': 4, 'score': score, 'highest': highest, 'moves': moves, 'duration': None, 'stats': None}
+        return
+
+    game_numbers = (game_number for game_number in range(1, args.games + 1) if game_number not in finished)
+    if (args.root_workers and args.strategy == 5) or (args.mcts_workers and args.strategy == 4): #games run one at a time here, the cores go to each move's search instead
+        try:
+            for game_number in game_numbers:
+                yield simulate_single_game(game_number, args.strategy, time_limit, settings, game_seed(args.seed, game_number), args.max_moves, args.trajectories, args.size)
+        finally:
+            shutdown_worker_pools()
+        return
+
+    #only a window of games is submitted at a time so memory stays flat however many games there are
+    window = args.window or 4 * (os.cpu_count() or 1)
+    initializer, initargs = worker_initializer()
+    with ProcessPoolExecutor(initializer=initializer, initargs=initargs) as executor:
+        pending = set()
+        try:
+            while True:
+                for game_number in islice(game_numbers, window - len(pending)):
+                    pending.add(executor.submit(simulate_single_game, game_number, args.strategy, time_limit, settings, game_seed(args.seed, game_number), args.max_moves, args.trajectories, args.size))
+                if not pending:
+                    break
+                
+                #process results as the games complete
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally: #don't start the queued games on ctrl-c, the running ones still finish
+            for future in pending:
+                future.cancel()
 
 def main():
     begin_time = time.time()
@@ -442,8 +1568,80 @@ def main():
     parser.add_argument("games", type=int, help="Number of games to simulate")
     parser.add_argument("strategy", type=int, choices=[1, 2, 3, 4, 5], help="Strategy to use (1 - 5)")
     parser.add_argument("limit", type=float, nargs='?', help="total amount of time that a set of games can run")
+    parser.add_argument("--size", type=int, default=4, help="play on size x size boards (3 to 6 are the usual variants)")
+    parser.add_argument("--seed", type=int, help="seed for every random choice, game n gets its own seed derived from it so reruns play the same games")
+    parser.add_argument("--max-moves", type=int, help="stop each game after this many turns, a budget that doesn't depend on machine load")
+    parser.add_argument("--depth", type=int, default=EXPECTIMAX_DEPTH, help="expectimax search depth, odd so moves and spawns alternate")
+    parser.add_argument("--move-time", type=float, help="per-move expectimax time budget in seconds, searches depths 1, 3, 5, ... until it runs out")
+    parser.add_argument("--move-nodes", type=int, help="per-move expectimax node budget, searches depths 1, 3, 5, ... until it runs out")
+    parser.add_argument("--adaptive-depth", action="store_true", help="pick the expectimax depth from the number of empty cells (also caps iterative deepening)")
+    parser.add_argument("--prob-cutoff", type=float, default=0.0, help="expectimax subtrees reached with a lower probability fall back to the heuristic")
+    parser.add_argument("--max-spawns", type=int, help="most spawn cells expanded per expectimax chance node")
+    parser.add_argument("--star", type=int, choices=[0, 1, 2], default=0, help="Star1/Star2 bound pruning at expectimax chance nodes")
+    parser.add_argument("--root-workers", type=int, default=0, help="search each expectimax move's root moves on this many worker processes, games then run one at a time")
+    parser.add_argument("--split-chance", action="store_true", help="with --root-workers, also split the first spawn layer across the workers")
+    parser.add_argument("--mcts-time", type=float, default=0.5, help="seconds per mcts move")
+    parser.add_argument("--mcts-iterations", type=int, help="iterations per mcts move instead of --mcts-time, makes mcts reproducible")
+    parser.add_argument("--mcts-workers", type=int, default=0, help="root parallel mcts: independent trees per move on this many worker processes, games then run one at a time")
+    parser.add_argument("--mcts-merge", choices=MCTS_MERGES, default='sum', help="how root parallel trees are merged: pooled mean, pooled visits or a vote")
+    parser.add_argument("--mcts-rollouts", type=int, default=1, help="leaf parallel mcts: playouts per expanded leaf")
+    parser.add_argument("--mcts-nodes", type=int, default=200000, help="memory cap of the mcts tree in nodes")
+    parser.add_argument("--mcts-playout", choices=list(PLAYOUTS), default='heuristic',
+                        help="mcts rollout policy: best heuristic move, biggest merge, first legal move of up/right/left/down, or random")
+    parser.add_argument("--mcts-playout-depth", type=int, default=25, help="moves per mcts rollout")
+    parser.add_argument("--no-mcts-reuse", action="store_true", help="build a new mcts tree every move instead of keeping the subtree of the position reached")
+    parser.add_argument("--tt-size", type=int, default=200000, help="max entries in each game's expectimax transposition table (0 disables it)")
+    parser.add_argument("--tt-policy", choices=['lru', 'depth'], default='lru', help="transposition table eviction: least recently used or depth preferred")
+    parser.add_argument("--ntuple", metavar="PATH", help="evaluate leaves with an n-tuple network weight file from ntuple2048.py instead of the snake heuristic")
+    parser.add_argument("--cache", metavar="PATH", help="persistent expectimax value cache file shared by every worker and run, created if missing (see cache2048.py)")
+    parser.add_argument("--cache-slots", type=int, default=1 << 20, help="slots in a new --cache file, 24 bytes each")
+    parser.add_argument("--cache-policy", choices=['depth', 'age'], default='depth', help="--cache eviction: shallowest entry or oldest run first")
+    parser.add_argument("--batched", action="store_true", help="simulate all games at once with numpy (strategies 1 - 3), limit then applies to the whole batch")
+    parser.add_argument("--results", metavar="PATH", help="append one json line per finished game (seed, score, highest, moves, duration) to PATH")
+    parser.add_argument("--resume", action="store_true", help="skip the games already in --results and count them in the totals")
+    parser.add_argument("--window", type=int, help="most games submitted to the process pool at once (default 4 per core)")
+    parser.add_argument("--trajectories", metavar="DIR", help="record every game's moves and tile spawns into DIR (one file per process), see trajectory2048.py")
+    parser.add_argument("--instrument", metavar="PATH", help="record per move search statistics and write their histograms and percentiles to PATH (.csv or .json)")
 
     args = parser.parse_args()
+    if args.batched and args.strategy not in (1, 2, 3):
+        parser.error("--batched only supports strategies 1, 2 and 3")
+    if args.batched and args.instrument:
+        parser.error("--instrument needs the per game engine, not --batched")
+    if args.batched and args.trajectories:
+        parser.error("--trajectories needs the per game engine, not --batched")
+    if args.depth < 1 or args.depth % 2 == 0: #see check_depth
+        parser.error("--depth must be odd and at least 1")
+    if args.mcts_iterations is not None and args.mcts_iterations < 1:
+        parser.error("--mcts-iterations must be at least 1")
+    if args.mcts_time <= 0:
+        parser.error("--mcts-time must be positive")
+    if args.mcts_rollouts < 1:
+        parser.error("--mcts-rollouts must be at least 1")
+    if args.mcts_workers < 0:
+        parser.error("--mcts-workers can't be negative")
+    if args.root_workers and args.move_nodes and args.strategy == 5:
+        parser.error("--move-nodes can't be split across --root-workers, use --move-time")
+    if args.ntuple and args.star:
+        parser.error("--star needs the bounds of the snake heuristic, not --ntuple")
+    if args.size < 2:
+        parser.error("--size must be at least 2")
+    if args.size != 4: #these keep 4x4 boards in fixed size formats
+        for option in ('batched', 'ntuple', 'cache', 'trajectories'):
+            if getattr(args, option):
+                parser.error(f"--{option} only supports 4x4 boards")
+    set_board_size(args.size) #before any worker pool starts
+    if args.ntuple:
+        use_ntuple(args.ntuple)
+    if args.cache and args.strategy == 5: #open it here so a file of another evaluator or pruning is a usage error, not a traceback from the game loop
+        try:
+            get_shared_cache(args.cache, args.cache_slots, args.cache_policy, args.prob_cutoff, args.max_spawns)
+        except ValueError as error:
+            parser.error(str(error))
+    if args.resume and not args.results:
+        parser.error("--resume needs --results")
+    if args.resume and args.batched:
+        parser.error("--batched games share one random stream and can't be resumed")
 
     if args.games == 0:
         game = Game2048()
@@ -460,37 +1658,95 @@ def main():
     max_score = 0
     high_tile = 0
     total_wins = 0
-
-    with ProcessPoolExecutor() as executor:
-        futures = []
-
-        #submit each game as a task
-        for game_number in range(1, args.games + 1):
-            futures.append(executor.submit(simulate_single_game, game_number, args.strategy, time_limit))
-        
-        #process results as the games complete
-        for future in as_completed(futures):
-            score, highest = future.result()
-
-            #update aggregates
-            total_score += score
-            total_tiles[highest] += 1
-            high_tile = max(high_tile, highest)
-            max_score = max(max_score, score)
-            if highest >= 2048:
-                total_wins += 1
+    tt_hits = 0
+    tt_misses = 0
+    shared_hits = 0
+    pruned = defaultdict(int)
+    reused_nodes = 0
+    rollouts = 0
+    rollout_seconds = 0.0
+    instrument_totals = SearchInstrument()
+    games_played = 0
+
+    finished = {}
+    if args.resume:
+        finished = {game_number: record for game_number, record in read_results(args.results).items() if game_number <= args.games}
+        if any(record['strategy'] != args.strategy for record in finished.values()):
+            parser.error(f"{args.results} holds games of another strategy")
+        if any(record.get('size', 4) != args.size for record in finished.values()):
+            parser.error(f"{args.results} holds games of another board size")
+        if args.seed is not None and any(record['seed'] != game_seed(args.seed, game_number) for game_number, record in finished.items()):
+            parser.error(f"{args.results} holds games of another --seed")
+        if any(record.get('settings') != run_settings(args) for record in finished.values()):
+            parser.error(f"{args.results} holds games played with other settings, expected {run_settings(args)}")
+    results = open_results(args.results) if args.results else None
+
+    def records(): #resumed games count towards the totals, their search stats weren't kept
+        yield from finished.values()
+        for record in run_games(args, time_limit, finished):
+            record['settings'] = run_settings(args)
+            if results is not None:
+                write_result(results, record)
+            yield record
+
+    for record in records():
+        score = record['score']
+        highest = record['highest']
+        search_stats = record.get('stats')
+        #update aggregates
+        games_played += 1
+        total_score += score
+        total_tiles[highest] += 1
+        high_tile = max(high_tile, highest)
+        max_score = max(max_score, score)
+        if highest >= 2048:
+            total_wins += 1
+        if search_stats and 'tt' in search_stats:
+            tt_hits += search_stats['tt']['hits']
+            tt_misses += search_stats['tt']['misses']
+            shared_hits += search_stats['tt']['shared_hits']
+        if search_stats and 'pruning' in search_stats:
+            for option, skipped in search_stats['pruning'].items():
+                pruned[option] += skipped['subtrees']
+        if search_stats and 'mcts' in search_stats:
+            reused_nodes += search_stats['mcts']['reused_nodes']
+            rollouts += search_stats['mcts']['rollouts']
+            rollout_seconds += search_stats['mcts']['seconds']
+        if search_stats and 'instrument' in search_stats:
+            instrument_totals.merge(search_stats['instrument'])
+    if results is not None:
+        results.close()
 
     # strat_name = ["wasd on repeat", "random", "random right/down", "right then down", "greedy (take highest score)", "mcts", "expectimax"]
     strat_name = ["random", "random right/down", "greedy (take highest score)", "mcts", "expectimax"]
     sorted_by_keys = dict(sorted(total_tiles.items(), reverse=True))
 
     print(f"Simulation Complete! Strategy: {strat_name[args.strategy - 1]}")
-    print(f"Total Games Played: {args.games}")
+    if args.size != 4:
+        print(f"Board Size: {args.size}x{args.size}")
+    print(f"Total Games Played: {games_played}")
     print(f"Highest Score Achieved: {max_score}")
     print(f"Highest Tile Achieved: {high_tile}")
-    print(f"Average Score: {total_score / args.games:.2f}")
+    print(f"Average Score: {total_score / games_played:.2f}")
     print(f"Highest Tile Distribution: {sorted_by_keys}")
-    print(f"Win Percentage: {total_wins / args.games:.2f}")
+    print(f"Win Percentage: {total_wins / games_played:.2f}")
+    if tt_hits + tt_misses:
+        print(f"Transposition Table: {tt_hits} hits, {tt_misses} misses, hit rate {tt_hits / (tt_hits + tt_misses):.2%}")
+    if args.cache and tt_hits + tt_misses:
+        print(f"Shared Cache: {shared_hits} of the hits came from {args.cache}")
+    if pruned:
+        print(f"Subtrees Pruned: {dict(pruned)}")
+    if reused_nodes:
+        print(f"MCTS Nodes Reused: {reused_nodes}")
+    if rollouts:
+        print(f"MCTS Rollouts: {rollouts}, {rollouts / rollout_seconds:,.0f} rollouts/s ({args.mcts_playout} playout, depth {args.mcts_playout_depth})")
+    if args.instrument:
+        report = instrument_totals.report()
+        for name in SearchInstrument.HISTOGRAMS:
+            if report[name]['count']:
+                print(f"Per Move {name}: p50 {report[name]['p50']:.4g}, p90 {report[name]['p90']:.4g}, p99 {report[name]['p99']:.4g}, max {report[name]['max']:.4g}")
+        instrument_totals.write(args.instrument)
+        print(f"Search statistics written to {args.instrument}")
     end_time = time.time()
     print(f"Start time: {begin_time}, end time: {end_time}, time elapsed: {end_time - begin_time:.3f}")
 
@@ -0,0 +1,190 @@
+import argparse
+import mmap
+import os
+import random
+import struct
+import time
+
+"""
+N-tuple network value function, a drop-in replacement for the snake heuristic, and a self-play TD(0) trainer for it:
+
+    python ntuple2048.py train weights.ntw --games 20000 --workers 4    #creates the file if missing, continues training otherwise
+    python game2048.py 100 5 --depth 3 --ntuple weights.ntw              #expectimax (or mcts) with the network at the leaves
+
+The value of an afterstate (the board right after a move, before the spawn) is the sum of one weight per tuple: a tuple is a fixed
+list of cells, and its 4 bit exponents index a table with 16 ** len(cells) weights. Every tuple is also read through the 8 symmetries
+of the board (rotations and reflections) with the same table, so a pattern learned in one corner counts in all of them.
+
+Weight file, little endian: magic, tuple count (u32), games trained (u64), then 8 cell bytes per tuple (0xFF padded) padded to 64
+bytes, then the float32 tables one after the other. Loading memory maps the tables instead of reading them, so it is instant
+and processes evaluating with the same file share one copy. The trainer maps it writable and its workers update it in place
+without locks (Hogwild style), the odd lost update doesn't hurt TD learning.
+"""
+
+MAGIC = b'2048NTW1'
+HEADER = struct.Struct('<8sIQ')
+MAX_CELLS = 8
+TUPLE_CELLS = struct.Struct(f'<{MAX_CELLS}B')
+ALIGN = 64
+#straight lines (outer and inner row) and 2x2 squares (corner, edge, center), cells numbered 4 * row + column like the bitboard
+DEFAULT_TUPLES = [(0, 1, 2, 3), (4, 5, 6, 7), (0, 1, 4, 5), (1, 2, 5, 6), (5, 6, 9, 10)]
+
+def symmetric_cells(cells): #the cells of a tuple under the 8 rotations and reflections of the board
+    images = []
+    for symmetry in range(8):
+        image = []
+        for cell in cells:
+            r, c = divmod(cell, 4)
+            if symmetry & 4:
+                r, c = c, r
+            if symmetry & 2:
+                r = 3 - r
+            if symmetry & 1:
+                c = 3 - c
+            image.append(4 * r + c)
+        images.append(tuple(image))
+    return images
+
+def weights_offset(tuple_count):
+    size = HEADER.size + tuple_count * TUPLE_CELLS.size
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+class NTupleNetwork: #callable (board, score) -> score + value of the board, like TableEvaluator
+    def __init__(self, tuples, tables, games=0, name='NTuple'):
+        self.tuples = tuples
+        self.tables = tables #one float sequence of 16 ** len(cells) weights per tuple, memoryviews of the weight file when loaded
+        self.games = games #self-play games the weights were trained on
+        self.name = name #identifies the weights in a cache2048 tag
+        #one (table, shifts) per symmetric image of every tuple, the first cell is the most significant nibble of the index
+        self.features = [(table, tuple(4 * cell for cell in image)) for table, cells in zip(tables, tuples) for image in symmetric_cells(cells)]
+
+    def value(self, board):
+        total = 0.0
+        for table, shifts in self.features:
+            index = 0
+            for shift in shifts:
+                index = (index << 4) | ((board >> shift) & 15)
+            total += table[index]
+        return total
+
+    def __call__(self, board, score):
+        return score + self.value(board)
+
+    def update(self, board, delta): #moves every weight the board reads by delta
+        for table, shifts in self.features:
+            index = 0
+            for shift in shifts:
+                index = (index << 4) | ((board >> shift) & 15)
+            table[index] += delta
+
+def create_weights(path, tuples=DEFAULT_TUPLES): #all zero tables, written under a temporary name so nothing maps a half made file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(tuples), 0))
+        for cells in tuples:
+            f.write(TUPLE_CELLS.pack(*cells, *[0xFF] * (MAX_CELLS - len(cells))))
+        f.truncate(weights_offset(len(tuples)) + sum(16 ** len(cells) for cells in tuples) * 4)
+    os.replace(temporary, path)
+
+def load_network(path, writable=False):
+    with open(path, 'r+b' if writable else 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ) #stays valid after the file is closed
+    magic, tuple_count, games = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not an n-tuple weight file")
+    tuples = []
+    for i in range(tuple_count):
+        cells = TUPLE_CELLS.unpack_from(data, HEADER.size + i * TUPLE_CELLS.size)
+        tuples.append(tuple(cell for cell in cells if cell != 0xFF))
+    weights = memoryview(data)[weights_offset(tuple_count):].cast('f')
+    start = 0
+    tables = []
+    for cells in tuples:
+        tables.append(weights[start:start + 16 ** len(cells)])
+        start += 16 ** len(cells)
+    network = NTupleNetwork(tuples, tables, games, f"NTuple {games}g {os.path.basename(path)}")
+    network.map = data #kept so the trainer can record the games it played
+    return network
+
+def record_games(network, games): #bumps the games trained counter in the file header
+    network.games += games
+    magic, tuple_count, _ = HEADER.unpack_from(network.map, 0)
+    HEADER.pack_into(network.map, 0, magic, tuple_count, network.games)
+
+def train_games(path, games, alpha, seed): #runs in a worker: TD(0) on afterstates, updating the shared weight file in place
+    from game2048 import Game2048
+    network = load_network(path, writable=True)
+    step = alpha / len(network.features) #alpha is the step of the whole value, split over the weights that make it up
+    rng = random.Random(seed)
+    results = []
+    for _ in range(games):
+        game = Game2048(rng.getrandbits(64))
+        previous = None #afterstate of the previous move
+        while True:
+            successors = game.successors()
+            if not successors:
+                break
+            best = None
+            for move, board, gained, highest in successors: #greedy on reward + value of the afterstate
+                value = gained + network.value(board)
+                if best is None or value > best_value:
+                    best = (board, gained, highest)
+                    best_value = value
+            board, gained, highest = best
+            if previous is not None: #V(previous) -> reward of this move + V(this afterstate)
+                network.update(previous, step * (best_value - network.value(previous)))
+            previous = board
+            game.bitboard = board
+            game.score += gained
+            game.highest = highest
+            game.moves += 1
+            game.add_random_tile()
+        if previous is not None: #the game ended, nothing more to come after the last afterstate
+            network.update(previous, step * -network.value(previous))
+        results.append((game.score, game.highest))
+    network.map.flush()
+    return results
+
+def train(path, games, workers=1, alpha=0.1, chunk=100, seed=None):
+    from concurrent.futures import ProcessPoolExecutor
+    if not os.path.exists(path):
+        create_weights(path)
+    network = load_network(path, writable=True)
+    rng = random.Random(seed)
+    start_time = time.time()
+    played = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunks = [min(chunk, games - start) for start in range(0, games, chunk)]
+        futures = [executor.submit(train_games, path, count, alpha, rng.getrandbits(64)) for count in chunks]
+        for future in futures:
+            results = future.result()
+            played += len(results)
+            record_games(network, len(results))
+            scores = [score for score, _ in results]
+            reached = sum(highest >= 2048 for _, highest in results)
+            print(f"{played} games ({network.games} total): average score {sum(scores) / len(scores):.0f}, max tile {max(highest for _, highest in results)}, "
+                  f"2048 rate {reached / len(results):.1%}, {played / (time.time() - start_time):.1f} games/s")
+    network.map.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or inspect an n-tuple network evaluator for 2048.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    train_parser = commands.add_parser("train", help="self-play TD(0) training, continues from the file if it exists")
+    train_parser.add_argument("weights", help="weight file, created with zero weights if missing")
+    train_parser.add_argument("--games", type=int, default=1000, help="self-play games to train on")
+    train_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes updating the weights at once")
+    train_parser.add_argument("--alpha", type=float, default=0.1, help="TD learning rate for the whole value, split over its weights")
+    train_parser.add_argument("--chunk", type=int, default=100, help="games per worker task, progress is printed after each")
+    train_parser.add_argument("--seed", type=int, help="seed for the self-play games")
+    info_parser = commands.add_parser("info", help="print the tuples and training games of a weight file")
+    info_parser.add_argument("weights")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        network = load_network(args.weights)
+        print(f"{args.weights}: {len(network.tuples)} tuples {network.tuples}, {len(network.features)} features, trained on {network.games} games")
+        return
+    train(args.weights, args.games, args.workers, args.alpha, args.chunk, args.seed)
+
+if __name__ == "__main__":
+    main()
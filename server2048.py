@@ -0,0 +1,243 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+from game2048 import (MOVES, EXPECTIMAX_DEPTH, Game2048, GameSearch, SearchSettings, Histogram, board_to_bits, max_exponent,
+                      get_executor, use_ntuple, shutdown_worker_pools)
+
+"""
+Long running move advice server, one JSON object per line in each direction:
+
+    python server2048.py --workers 4                       #stdin/stdout
+    python server2048.py --socket /tmp/2048.sock           #unix socket, any number of clients
+    python server2048.py --port 2048                       #tcp on localhost
+
+    {"id": 7, "board": [[0, 2, 0, 0], [0, 0, 4, 0], [0, 0, 0, 0], [2, 0, 0, 0]], "score": 4, "strategy": 5}
+    {"id": 7, "move": "a"}
+
+"board" can also be given as "bitboard", the packed int of Game2048.bitboard. "strategy" is 3 (greedy), 4 (mcts) or 5 (expectimax,
+the default), "seed" makes an mcts answer reproducible. A board with no legal move gets "move": null. {"id": ..., "stats": true}
+returns the requests served, the batch sizes and the latency percentiles so far.
+
+Requests are answered as they finish, not in order, so clients match responses by id. Search requests that arrive close together
+are batched onto a persistent worker pool, each worker keeps its transposition table (values are relative to the score, so any
+game's entries are useful to any other) and the lookup tables warm for as long as the server runs.
+"""
+
+server_searches = {} #strategy -> GameSearch kept for the life of the worker, so its transposition table stays warm between requests
+
+def advise(requests, settings): #runs in a worker: [(bitboard, score, strategy, seed)] -> [(move, None when the game is over, error or None)]
+    answers = []
+    for bitboard, score, strategy, seed in requests:
+        try: #a request that fails only fails itself, not the rest of its batch
+            if strategy not in server_searches:
+                server_searches[strategy] = GameSearch(strategy, settings)
+            state = Game2048(seed)
+            state.bitboard = bitboard
+            state.score = score
+            state.highest = 1 << max_exponent(bitboard)
+            successors = state.successors()
+            move = MOVES[state.determine_move(strategy, -1, settings, server_searches[strategy], successors)] if successors else None
+            answers.append((move, None))
+        except Exception as error:
+            answers.append((None, f"search failed: {error}"))
+    return answers
+
+def is_int(value): #json true/false parse as bools, which are ints to python
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def parse_board(request): #packed bitboard of a request, ValueError if it isn't a valid 4x4 board
+    if 'bitboard' in request:
+        bitboard = request['bitboard']
+        if not is_int(bitboard) or not 0 <= bitboard < 1 << 64:
+            raise ValueError("bitboard must be an int in [0, 2 ** 64)")
+        return bitboard
+    board = request.get('board')
+    if not isinstance(board, list) or len(board) != 4 or any(not isinstance(row, list) or len(row) != 4 for row in board):
+        raise ValueError("board must be a 4x4 list of lists")
+    for row in board:
+        for value in row:
+            if not is_int(value) or value < 0 or value & (value - 1) or value > 1 << 15 or value == 1:
+                raise ValueError(f"board values must be 0 or powers of two from 2 to 32768, not {value!r}")
+    return board_to_bits(board)
+
+def warm_worker(settings): #builds the searches before the first request, and keeps the worker busy long enough for the pool to start the next one
+    for strategy in (4, 5):
+        if strategy not in server_searches:
+            server_searches[strategy] = GameSearch(strategy, settings)
+    time.sleep(0.1)
+
+class AdviceServer: #parses requests, batches the searches onto the pool and keeps the latency stats
+    def __init__(self, settings, workers=0, batch_size=64, batch_wait=0.002):
+        self.settings = settings
+        self.workers = workers #0 searches in this process on a thread, so the event loop keeps reading
+        self.executor = get_executor(workers) if workers else None
+        self.batch_size = batch_size #most requests per pool job
+        self.batch_wait = batch_wait #seconds a batch waits for more requests after the first one arrives
+        self.queue = None #made in run_server, inside the event loop it belongs to
+        self.latency = Histogram() #milliseconds from parsing a request to having its move
+        self.batches = Histogram()
+        self.served = 0
+        if self.executor is not None:
+            #the pool starts its processes on demand, a process forked while a client is connected would hold that
+            #client's socket open after we close it, so every worker is started here before anything connects
+            for future in [self.executor.submit(warm_worker, settings) for _ in range(workers)]:
+                future.result()
+
+    async def batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.batch_size * max(self.workers, 1):
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            #one job per worker so a burst spreads over the whole pool
+            jobs = max(1, min(max(self.workers, 1), len(batch)))
+            for i in range(jobs):
+                chunk = batch[i::jobs]
+                self.batches.add(len(chunk))
+                asyncio.ensure_future(self.run_chunk(chunk))
+
+    async def run_chunk(self, chunk):
+        loop = asyncio.get_running_loop()
+        try:
+            moves = await loop.run_in_executor(self.executor, advise, [request for request, _ in chunk], self.settings)
+        except Exception as error: #a failed job answers its requests with the error instead of hanging them
+            for _, future in chunk:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (_, future), answer in zip(chunk, moves):
+            future.set_result(answer)
+
+    async def answer(self, line): #one request line -> one response dict
+        start = time.perf_counter()
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return {'id': None, 'error': "invalid json"}
+        if not isinstance(request, dict):
+            return {'id': None, 'error': "request must be a json object"}
+        request_id = request.get('id')
+        if request.get('stats'):
+            return {'id': request_id, 'served': self.served, 'latency_ms': self.latency.report(), 'batch_size': self.batches.report()}
+        try: #everything a worker gets is checked here, so a bad request can't fail the batch it would join
+            bitboard = parse_board(request)
+            strategy = request.get('strategy', 5)
+            if not is_int(strategy) or strategy not in (3, 4, 5):
+                raise ValueError("strategy must be 3, 4 or 5")
+            score = request.get('score', 0)
+            if not is_int(score) or score < 0:
+                raise ValueError("score must be a non negative int")
+            seed = request.get('seed', random.getrandbits(64))
+            if not is_int(seed):
+                raise ValueError("seed must be an int")
+            search = (bitboard, score, strategy, seed)
+        except ValueError as error:
+            return {'id': request_id, 'error': f"bad request: {error}"}
+
+        if strategy == 3: #greedy is a few table lookups, cheaper than a trip to the pool
+            move, error = advise([search], self.settings)[0]
+        else:
+            future = asyncio.get_running_loop().create_future()
+            await self.queue.put((search, future))
+            try:
+                move, error = await future
+            except Exception as error:
+                return {'id': request_id, 'error': str(error)}
+        if error is not None:
+            return {'id': request_id, 'error': error}
+        self.served += 1
+        self.latency.add((time.perf_counter() - start) * 1000)
+        return {'id': request_id, 'move': move}
+
+    async def serve_lines(self, reader, write): #answers every line of reader concurrently, write(response line) as each finishes
+        pending = set()
+        async def respond(line):
+            write(json.dumps(await self.answer(line)) + '\n')
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.strip():
+                task = asyncio.ensure_future(respond(line))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.wait(pending)
+
+    async def handle_client(self, reader, writer):
+        try:
+            await self.serve_lines(reader, lambda response: writer.write(response.encode()))
+            await writer.drain()
+        finally:
+            writer.close()
+
+async def run_server(server, socket_path=None, port=None):
+    server.queue = asyncio.Queue()
+    batcher = asyncio.ensure_future(server.batcher())
+    try:
+        if socket_path is not None or port is not None:
+            if socket_path is not None:
+                listener = await asyncio.start_unix_server(server.handle_client, socket_path)
+            else:
+                listener = await asyncio.start_server(server.handle_client, '127.0.0.1', port)
+            async with listener:
+                await listener.serve_forever()
+            return
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        def write(response):
+            sys.stdout.write(response)
+            sys.stdout.flush()
+        await server.serve_lines(reader, write)
+    finally:
+        batcher.cancel()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve 2048 move advice over JSON lines.")
+    parser.add_argument("--socket", metavar="PATH", help="listen on a unix socket instead of stdin/stdout")
+    parser.add_argument("--port", type=int, help="listen on this localhost tcp port instead of stdin/stdout")
+    parser.add_argument("--workers", type=int, default=0, help="persistent worker processes for the searches, 0 searches in process")
+    parser.add_argument("--batch-size", type=int, default=64, help="most requests per worker job")
+    parser.add_argument("--batch-wait", type=float, default=0.002, help="seconds a batch waits for more requests")
+    parser.add_argument("--depth", type=int, default=EXPECTIMAX_DEPTH, help="expectimax search depth")
+    parser.add_argument("--move-time", type=float, help="per-move expectimax time budget in seconds (iterative deepening)")
+    parser.add_argument("--tt-size", type=int, default=200000, help="entries in each worker's transposition table")
+    parser.add_argument("--mcts-time", type=float, default=0.5, help="seconds per mcts move")
+    parser.add_argument("--mcts-iterations", type=int, help="iterations per mcts move instead of --mcts-time")
+    parser.add_argument("--ntuple", metavar="PATH", help="n-tuple network weights to evaluate leaves with, see ntuple2048.py")
+    parser.add_argument("--cache", metavar="PATH", help="persistent expectimax value cache shared by the workers, see cache2048.py")
+    args = parser.parse_args()
+    if args.depth < 1 or args.depth % 2 == 0: #see game2048.check_depth
+        parser.error("--depth must be odd and at least 1")
+
+    if args.ntuple: #before the pool starts so its workers load the same weights
+        use_ntuple(args.ntuple)
+    settings = SearchSettings(args.depth, args.move_time, tt_size=args.tt_size, mcts_time=args.mcts_time, mcts_reuse=False,
+                              mcts_iterations=args.mcts_iterations, cache=args.cache)
+    if args.cache:
+        try:
+            settings.shared_cache().next_generation()
+        except ValueError as error: #a file of another evaluator
+            parser.error(str(error))
+    server = AdviceServer(settings, args.workers, args.batch_size, args.batch_wait)
+    try:
+        asyncio.run(run_server(server, args.socket, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown_worker_pools()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import game2048
+from game2048 import EXPECTIMAX_DEPTH, SearchSettings, simulate_single_game, game_seed, worker_initializer, use_ntuple, open_results, set_board_size
+
+"""
+Parameter sweep that regenerates the README results table in one run:
+
+    python sweep2048.py --games 100 --limits 15 30 60 inf --strategies 5 4 3 2 1 --depths 3 5 --mcts-times 0.5 --seed 1
+
+Every (config, game) pair is one job on a single process pool, submitted longest first so the slow expectimax games don't end up
+alone on one core at the end. Finished games are appended to --results as they complete, a rerun of the same sweep only plays the
+games that are missing and a bigger grid only plays the new configs. Game n of every config gets the same seed, so configs are
+compared on the same games.
+"""
+
+STRATEGY_NAMES = {1: "Random", 2: "Random Heuristic", 3: "Greedy", 4: "MCTS", 5: "Expectimax"}
+MOVES_PER_GAME = 1000 #rough length of a game, only used to order the jobs
+
+def configs(strategies, limits, depths, mcts_times, mcts_iterations, seed=None, max_moves=None, sizes=(4,), evaluator='snake'):
+    #one dict per cell of the grid, search knobs only where they matter, seed, max_moves and size are in every config so cached games of another run setup never mix in
+    #the search strategies also record the evaluator, so games played with another heuristic or network are never reused for them
+    grid = []
+    for limit, size in [(limit, size) for limit in limits for size in sizes]:
+        run = {'limit': limit, 'seed': seed, 'max_moves': max_moves, 'size': size}
+        for strategy in strategies:
+            if strategy == 5:
+                grid.extend(dict(run, strategy=5, depth=depth, evaluator=evaluator) for depth in depths)
+            elif strategy == 4:
+                grid.extend(dict(run, strategy=4, mcts_time=mcts_time, evaluator=evaluator) for mcts_time in mcts_times)
+                grid.extend(dict(run, strategy=4, mcts_iterations=iterations, evaluator=evaluator) for iterations in mcts_iterations)
+            else:
+                grid.append(dict(run, strategy=strategy))
+    return grid
+
+def config_key(config): #stable name of a config, stored with every game it played
+    return ",".join(f"{key}={value}" for key, value in sorted(config.items()))
+
+def config_label(config):
+    label = STRATEGY_NAMES[config['strategy']]
+    if config['size'] != 4:
+        label += f" {config['size']}x{config['size']}"
+    if config.get('evaluator', 'snake') != 'snake':
+        label += " (n-tuple)"
+    if 'depth' in config:
+        label += f" (depth {config['depth']})"
+    if 'mcts_time' in config:
+        label += f" ({config['mcts_time']:g}s/move)"
+    if 'mcts_iterations' in config:
+        label += f" ({config['mcts_iterations']} iterations)"
+    return label
+
+def config_settings(config):
+    return SearchSettings(depth=config.get('depth', EXPECTIMAX_DEPTH), mcts_time=config.get('mcts_time', 0.5), mcts_iterations=config.get('mcts_iterations'))
+
+def estimated_seconds(config, durations): #measured mean game time if this config already finished some games, a rough model otherwise
+    if durations:
+        return sum(durations) / len(durations)
+    if config['strategy'] == 5:
+        per_move = 1e-3 * 20 ** ((config['depth'] - 3) / 2) #each extra (max, chance) pair costs ~20x
+    elif config['strategy'] == 4:
+        per_move = config['mcts_time'] if 'mcts_time' in config else config['mcts_iterations'] * 2e-4
+    else:
+        per_move = 2e-5
+    return min(per_move * MOVES_PER_GAME, config['limit'])
+
+def run_game(key, game_number, config): #runs in a worker, which plays one game at a time so it can switch the board size between games
+    set_board_size(config['size'])
+    record = simulate_single_game(game_number, config['strategy'], config['limit'], config_settings(config), game_seed(config['seed'], game_number), config['max_moves'],
+                                  size=config['size'])
+    record['config'] = key
+    return record
+
+def sweep(grid, games, results_path, workers=None, window=None):
+    #returns {config key: [records]} for the whole grid, playing only the games not already in results_path
+    finished = defaultdict(dict)
+    if results_path and os.path.exists(results_path):
+        with open(results_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError: #cut off by a crash
+                    continue
+                finished[record['config']][record['game']] = record
+
+    jobs = []
+    for config in grid:
+        key = config_key(config)
+        done = finished[key]
+        cost = estimated_seconds(config, [record['duration'] for record in done.values()])
+        jobs.extend((cost, key, game_number, config) for game_number in range(1, games + 1) if game_number not in done)
+    jobs.sort(key=lambda job: -job[0]) #longest first
+    print(f"{sum(len(finished[config_key(config)]) for config in grid)} games cached, {len(jobs)} to play")
+
+    results = open_results(results_path) if results_path else None
+    initializer, initargs = worker_initializer()
+    window = window or 4 * (workers or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        pending = set()
+        queue = iter(jobs)
+        try:
+            while True:
+                for _, key, game_number, config in queue:
+                    pending.add(executor.submit(run_game, key, game_number, config))
+                    if len(pending) >= window:
+                        break
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record = future.result()
+                    record.pop('stats', None)
+                    finished[record['config']][record['game']] = record
+                    if results is not None:
+                        results.write(json.dumps(record) + '\n')
+                        results.flush()
+        finally: #don't start the queued games on ctrl-c, everything finished so far is already in the results file
+            for future in pending:
+                future.cancel()
+            if results is not None:
+                results.close()
+    return {config_key(config): [finished[config_key(config)][n] for n in range(1, games + 1) if n in finished[config_key(config)]] for config in grid}
+
+def table(grid, records): #markdown rows in the layout of the README results table
+    lines = ["| Time (s)  | Strategy | Total Games Played | Highest Score Achieved | Highest Tile Achieved | Average Score | Highest Tile Distribution | Win Percentage |",
+             "|-----------|----------|--------------------|------------------------|-----------------------|---------------|---------------------------|----------------|"]
+    previous_limit = None
+    for config in grid:
+        played = records[config_key(config)]
+        if not played:
+            continue
+        tiles = defaultdict(int)
+        for record in played:
+            tiles[record['highest']] += 1
+        scores = [record['score'] for record in played]
+        wins = sum(record['highest'] >= 2048 for record in played)
+        limit = config['limit']
+        time_label = "" if limit == previous_limit else ("No Limit" if limit == float('inf') else f"{limit:g}")
+        previous_limit = limit
+        lines.append(f"| {time_label} | {config_label(config)} | {len(played)} | {max(scores)} | {max(tiles)} | {sum(scores) / len(scores):.2f} | "
+                     f"{dict(sorted(tiles.items(), reverse=True))} | {wins / len(played):.2%} |")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep 2048 strategies and search settings on one process pool and print the results table.")
+    parser.add_argument("--games", type=int, default=100, help="games per config")
+    parser.add_argument("--strategies", type=int, nargs='+', choices=[1, 2, 3, 4, 5], default=[5, 4, 3, 2, 1])
+    parser.add_argument("--limits", type=float, nargs='+', default=[15, 30, 60, float('inf')], help="per game time limits in seconds, inf for none")
+    parser.add_argument("--depths", type=int, nargs='+', default=[EXPECTIMAX_DEPTH], help="expectimax depths")
+    parser.add_argument("--mcts-times", type=float, nargs='*', default=[0.5], help="mcts seconds per move")
+    parser.add_argument("--mcts-iterations", type=int, nargs='*', default=[], help="mcts iterations per move, reproducible unlike --mcts-times")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[4], help="board sizes, the ntuple network only plays 4x4")
+    parser.add_argument("--seed", type=int, help="game n of every config is seeded from this, so configs play the same games")
+    parser.add_argument("--max-moves", type=int, help="stop each game after this many turns")
+    parser.add_argument("--workers", type=int, help="worker processes (default one per core)")
+    parser.add_argument("--window", type=int, help="most games submitted to the pool at once (default 4 per worker)")
+    parser.add_argument("--results", default="sweep_results.jsonl", help="per game results, reused by later sweeps (empty string to disable)")
+    parser.add_argument("--output", help="also write the table to this file")
+    parser.add_argument("--ntuple", metavar="PATH", help="n-tuple network weights to evaluate leaves with, see ntuple2048.py")
+    args = parser.parse_args()
+    if any(depth < 1 or depth % 2 == 0 for depth in args.depths): #see game2048.check_depth
+        parser.error("--depths must be odd and at least 1")
+
+    if args.ntuple and args.sizes != [4]:
+        parser.error("--ntuple only supports 4x4 boards")
+    evaluator = 'snake'
+    if args.ntuple: #the name has the games the weights were trained on, the path tells networks of the same name apart
+        use_ntuple(args.ntuple)
+        evaluator = f"{game2048.evaluator.name} ({os.path.abspath(args.ntuple)})"
+    grid = configs(args.strategies, args.limits, args.depths, args.mcts_times, args.mcts_iterations, args.seed, args.max_moves, args.sizes, evaluator)
+    records = sweep(grid, args.games, args.results, args.workers, args.window)
+    output = table(grid, records)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+
+if __name__ == "__main__":
+    main()
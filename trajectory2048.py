@@ -0,0 +1,134 @@
+import argparse
+import mmap
+import os
+import struct
+from collections import namedtuple, defaultdict
+
+from game2048 import MOVES, SLIDES, max_exponent
+
+"""
+Compact game trajectories, written by game2048.py --trajectories DIR and replayed here without rerunning any search:
+
+    python game2048.py 100 5 --trajectories runs/expectimax
+    python trajectory2048.py runs/expectimax          #move distribution and when each tile was first reached
+
+File layout: the magic, then one record per game, appended as the game is played
+    header   game number (u32), strategy (u8), seed (u64), starting bitboard (u64), little endian
+    moves    one byte per move played: move index (MOVES order) << 4 | cell (0 - 15) the new 2 spawned in
+    0xFF     end of the game, a game cut off by a crash has no end marker and is read as incomplete
+Every legal move frees at least one cell so there is always a spawn, and spawns are always 2s, so the byte is the whole transition.
+"""
+
+MAGIC = b'2048TRJ1'
+HEADER = struct.Struct('<IBQQ')
+END = 0xFF
+
+Trajectory = namedtuple('Trajectory', ['game', 'strategy', 'seed', 'board', 'moves', 'complete'])
+
+class TrajectoryWriter: #one per process, every process writes to its own file so games never interleave
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(directory, f"{os.getpid()}.trj")
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        cut_off = False
+        if size > len(MAGIC):
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                cut_off = f.read(1)[0] != END
+        self.file = open(self.path, 'ab')
+        if not size:
+            self.file.write(MAGIC)
+        if cut_off: #a crashed run left a game open in a reused pid's file, close it so the next header parses
+            self.file.write(bytes((END,)))
+
+    def start(self, game_number, strategy, seed, board):
+        self.file.write(HEADER.pack(game_number, strategy, seed, board))
+
+    def move(self, move_index, shift):
+        self.file.write(bytes((move_index << 4 | shift >> 2,)))
+
+    def end(self):
+        self.file.write(bytes((END,)))
+        self.file.flush()
+
+def trajectory_files(paths): #files as given, directories expanded to the .trj files in them
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.trj'):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+def read_trajectories(paths): #streams every game in the files, each file is memory mapped so only the pages being read are loaded
+    for path in trajectory_files(paths):
+        if os.path.getsize(path) <= len(MAGIC):
+            continue
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a trajectory file")
+            pos = len(MAGIC)
+            while pos + HEADER.size <= len(data):
+                game, strategy, seed, board = HEADER.unpack_from(data, pos)
+                pos += HEADER.size
+                end = data.find(bytes((END,)), pos)
+                complete = end != -1
+                if not complete:
+                    end = len(data)
+                yield Trajectory(game, strategy, seed, board, data[pos:end], complete)
+                pos = end + 1
+
+def replay(trajectory): #yields (board, score, move) for every position a move was played from, then (final board, final score, None)
+    board = trajectory.board
+    score = 0
+    for code in trajectory.moves:
+        move = code >> 4
+        new_board, gained = SLIDES[move](board)
+        yield board, score, MOVES[move]
+        board = new_board | (1 << ((code & 15) << 2))
+        score += gained
+    yield board, score, None
+
+def trajectory_stats(trajectories):
+    games = 0
+    incomplete = 0
+    total_moves = 0
+    total_score = 0
+    move_counts = defaultdict(int)
+    reached_at = defaultdict(list) #tile -> move number it was first reached at, one entry per game that reached it
+    for trajectory in trajectories:
+        games += 1
+        incomplete += not trajectory.complete
+        highest = 0
+        for moves_played, (board, score, move) in enumerate(replay(trajectory)):
+            exponent = max_exponent(board)
+            while highest < exponent:
+                highest += 1
+                reached_at[1 << highest].append(moves_played)
+            if move is not None:
+                move_counts[move] += 1
+        total_moves += moves_played
+        total_score += score
+    return {'games': games, 'incomplete': incomplete, 'moves': total_moves, 'average_score': total_score / games if games else 0,
+            'move_distribution': {move: move_counts[move] / total_moves if total_moves else 0 for move in MOVES},
+            'tile_reached': {tile: {'games': len(at), 'mean_move': sum(at) / len(at), 'median_move': sorted(at)[len(at) // 2]}
+                             for tile, at in sorted(reached_at.items())}}
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded 2048 trajectories and summarize them.")
+    parser.add_argument("paths", nargs='+', help="trajectory files or directories of them")
+    parser.add_argument("--strategy", type=int, help="only games played by this strategy")
+    args = parser.parse_args()
+
+    trajectories = read_trajectories(args.paths)
+    if args.strategy is not None:
+        trajectories = (trajectory for trajectory in trajectories if trajectory.strategy == args.strategy)
+    stats = trajectory_stats(trajectories)
+    print(f"Games: {stats['games']} ({stats['incomplete']} incomplete), moves: {stats['moves']}, average score: {stats['average_score']:.2f}")
+    print("Move Distribution: " + ", ".join(f"{move} {share:.1%}" for move, share in stats['move_distribution'].items()))
+    for tile, reached in stats['tile_reached'].items():
+        print(f"{tile:>6}: reached in {reached['games']} games, mean move {reached['mean_move']:.1f}, median move {reached['median_move']}")
+
+if __name__ == "__main__":
+    main()